@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     name = 'blog'
+
+    # Connect the signal handlers that keep the denormalized data up to date.
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,209 @@
+import bisect
+import heapq
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.urls import reverse
+from taggit.models import Tag
+
+from .cache import LRUCache
+from .indexing import InMemoryIndex
+from .models import Post
+from .text import STOP_WORDS, words
+
+GENERATION = 'autocomplete'
+
+DEFAULT_AUTOCOMPLETE = {
+    # Number of suggestions returned per lookup.
+    'LIMIT': 8,
+    # Shortest prefix answered.
+    'MIN_LENGTH': 2,
+    # Seconds after which the popularity weights are reloaded in the background.
+    'REFRESH': 3600,
+}
+
+
+def autocomplete_settings():
+    return {**DEFAULT_AUTOCOMPLETE, **getattr(settings, 'BLOG_AUTOCOMPLETE', {})}
+
+
+# Keys under which a title or tag name is found: the text starting at each of its
+# - words (stop words excepted), so "tips" finds "Django tips".
+def prefix_keys(text):
+    text_words = words(text)
+    return {
+        ' '.join(text_words[i:])
+        for i, word in enumerate(text_words)
+        if i == 0 or word not in STOP_WORDS
+    }
+
+
+# In-process prefix index over the titles of the published posts and the tag names,
+# - for the search box autocomplete. Entries are keyed ('post', id) or ('tag', id) and
+# - their prefix keys are kept in one sorted list of (key, entry) pairs, so a prefix
+# - is looked up with bisect, and matches are ranked by popularity (comments of a post,
+# - posts of a tag). Popular prefixes are memoized until the index changes. It's
+# - built and kept up to date like every InMemoryIndex; weights are reloaded every
+# - BLOG_AUTOCOMPLETE['REFRESH'] seconds.
+class AutocompleteIndex(InMemoryIndex):
+    generation_name = GENERATION
+    label = 'autocomplete index'
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []
+        self._entries = {}
+        self._built_at = 0
+        self._memo = LRUCache(10000)
+
+    ####
+    # Building
+    ####
+
+    def load(self):
+        entries = {}
+        for pk, title, slug, publish, comments in Post.published.values_list(
+            'id', 'title', 'slug', 'publish', 'comment_count',
+        ).iterator():
+            entries[('post', pk)] = self._post_entry(title, slug, publish, comments)
+        tag_counts = dict(
+            Post.published.filter(tags__isnull=False).values_list('tags__id').annotate(
+                posts=Count('pk'),
+            ).order_by()
+        )
+        for pk, name, slug in Tag.objects.values_list('id', 'name', 'slug').iterator():
+            entries[('tag', pk)] = self._tag_entry(name, slug, tag_counts.get(pk, 0))
+        return entries
+
+    def install(self, entries):
+        self._entries = entries
+        self._keys = sorted(
+            (key, entry) for entry, (label, url, weight, keys) in entries.items() for key in keys
+        )
+        self._built_at = time.monotonic()
+        self._memo.clear()
+
+    def describe(self):
+        return f'{len(self._entries)} titles and tags, {len(self._keys)} keys'
+
+    # The popularity weights are reloaded once they're older than REFRESH seconds.
+    @property
+    def warm(self):
+        warm = super().warm
+        if warm and time.monotonic() - self._built_at > autocomplete_settings()['REFRESH']:
+            self.rebuild_in_background()
+        return warm
+
+    @staticmethod
+    def _post_entry(title, slug, publish, comments):
+        url = reverse('blog:post_detail', args=[publish.year, publish.month, publish.day, slug])
+        return title, url, comments, tuple(prefix_keys(title))
+
+    @staticmethod
+    def _tag_entry(name, slug, posts):
+        return name, reverse('blog:post_list_by_tag', args=[slug]), posts, tuple(prefix_keys(name))
+
+    ####
+    # Updates
+    ####
+
+    # Add, change or drop the entry of a post. Applied once the transaction commits.
+    def update_post(self, post):
+        change = self._post_change(post)
+        transaction.on_commit(lambda: self.update(*change))
+
+    def update_posts(self, posts):
+        changes = [self._post_change(post) for post in posts]
+        transaction.on_commit(lambda: self.update_many(changes))
+
+    def _post_change(self, post):
+        entry = None
+        if post.status == 'published':
+            entry = self._post_entry(post.title, post.slug, post.publish, post.comment_count)
+        return ('post', post.pk), entry
+
+    def remove_post(self, pk):
+        transaction.on_commit(lambda: self.update(('post', pk), None))
+
+    # A new tag counts as used once, until the weights are reloaded.
+    def update_tag(self, tag):
+        old = self._entries.get(('tag', tag.pk))
+        entry = self._tag_entry(tag.name, tag.slug, old[2] if old else 1)
+        transaction.on_commit(lambda: self.update(('tag', tag.pk), entry))
+
+    def remove_tag(self, pk):
+        transaction.on_commit(lambda: self.update(('tag', pk), None))
+
+    def apply(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            for prefix in old[3]:
+                del self._keys[bisect.bisect_left(self._keys, (prefix, key))]
+        if entry is not None:
+            self._entries[key] = entry
+            for prefix in entry[3]:
+                bisect.insort(self._keys, (prefix, key))
+        self._memo.clear()
+
+    ####
+    # Queries
+    ####
+
+    # Up to `limit` suggestions for what the reader typed so far, most popular first,
+    # - as dicts with the label, the url and the type ('post' or 'tag'). None when
+    # - the index is cold.
+    def suggest(self, prefix, limit):
+        if not self.warm:
+            return None
+        prefix = ' '.join(words(prefix)) + (' ' if prefix[-1:].isspace() else '')
+        return self._memo.get_or_set((prefix, limit), lambda: self._suggest(prefix, limit))
+
+    def _suggest(self, prefix, limit):
+        with self._lock:
+            matches = set()
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and self._keys[position][0].startswith(prefix):
+                matches.add(self._keys[position][1])
+                position += 1
+            best = heapq.nlargest(
+                limit, (entry for entry in matches if self._entries[entry][2] or entry[0] == 'post'),
+                key=lambda entry: (self._entries[entry][2], entry[0] == 'tag', entry[1]),
+            )
+            return [
+                {'label': self._entries[entry][0], 'url': self._entries[entry][1], 'type': entry[0]}
+                for entry in best
+            ]
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+# Suggestions straight from the database, while the index is building.
+def database_suggestions(prefix, limit):
+    posts = Post.published.filter(title__istartswith=prefix).order_by('-comment_count')
+    suggestions = [
+        {'label': post.title, 'url': post.get_absolute_url(), 'type': 'post'}
+        for post in posts.only('title', 'slug', 'publish')[:limit]
+    ]
+    for name, slug in Tag.objects.filter(name__istartswith=prefix).values_list('name', 'slug')[:limit - len(suggestions)]:
+        suggestions.append({'label': name, 'url': reverse('blog:post_list_by_tag', args=[slug]), 'type': 'tag'})
+    return suggestions
+
+
+# Suggestions for the search box: from the index when it's warm, else from the database.
+def suggest(prefix):
+    options = autocomplete_settings()
+    if len(prefix.strip()) < options['MIN_LENGTH']:
+        return []
+    suggestions = autocomplete_index.suggest(prefix, options['LIMIT'])
+    if suggestions is None:
+        suggestions = database_suggestions(prefix.strip(), options['LIMIT'])
+    return suggestions
+
+
+# Build the index the first time the process serves a request.
+def warm_autocomplete_index(**kwargs):
+    if not autocomplete_index.built:
+        autocomplete_index.rebuild_in_background()
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+
+_missing = object()
+
+
+# Size of a cached text in bytes (UTF-8 encoded), or the length of another value.
+def utf8_size(value):
+    return len(value.encode()) if isinstance(value, str) else len(value)
+
+
+# A thread safe, in-process LRU cache bounded by number of entries and,
+# - optionally, by the total size of its values (UTF-8 bytes of text by default).
+# - It keeps hit/miss counters so its effectiveness can be checked from a shell or
+# - a stats page.
+class LRUCache:
+    def __init__(self, max_entries, max_bytes=None, sizeof=utf8_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._computing = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                size, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        # A value bigger than the whole cache would only evict everything else.
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._data.pop(key)[0]
+            self._data[key] = (size, value)
+            self.bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self.bytes -= self._data.popitem(last=False)[1][0]
+                self.evictions += 1
+
+    # Return the cached value, or compute, store and return it. Threads missing
+    # - the same key wait for the first one to compute it instead of all computing
+    # - it at once (a cache stampede); their lookups count as hits.
+    def get_or_set(self, key, compute):
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._data.get(key)
+                if entry is not None:
+                    self._data.move_to_end(key)
+                    self.misses -= 1
+                    self.hits += 1
+                    return entry[1]
+            value = compute()
+            self.set(key, value)
+            return value
+
+    @contextmanager
+    def _key_lock(self, key):
+        with self._lock:
+            entry = self._computing.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._computing[key]
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._data.pop(key)[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+####
+# Generation counters
+####
+
+# A generation is a number stored in the shared cache that is bumped whenever
+# - the data behind a cache or an in-memory index changes. Cache keys that
+# - include it go stale at once, in every process, without deleting anything.
+
+# Generation of the cached sidebar fragment in templates/blog/base.html.
+SIDEBAR_GENERATION = 'sidebar'
+# Generation of the search corpus (published posts), part of the search result cache keys.
+SEARCH_GENERATION = 'search'
+# Generation of the syndication feeds (blog.feeds).
+FEED_GENERATION = 'feed'
+
+
+def _generation_key(name):
+    return f'blog:generation:{name}'
+
+
+# A fresh starting value. It's time based so that a generation that fell out
+# - of the cache never restarts at a number some process has already seen.
+def _initial_generation():
+    return int(time.time() * 1000)
+
+
+def get_generation(name):
+    return cache.get_or_set(_generation_key(name), _initial_generation, None)
+
+
+# Bump the generation and return the new value.
+def bump_generation(name):
+    try:
+        return cache.incr(_generation_key(name))
+    except ValueError:
+        generation = _initial_generation()
+        cache.set(_generation_key(name), generation, None)
+        return generation
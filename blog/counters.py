@@ -0,0 +1,167 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from .models import Comment, Post, PostCounter
+
+
+def status_key(status):
+    return f'status:{status}'
+
+
+def tag_key(tag_id):
+    return f'tag:{tag_id}'
+
+
+def _cache_key(key):
+    return f'blog:counter:{key}'
+
+
+# Count a counter straight from the posts table. Used to seed a counter the
+# - first time it is read or changed.
+def exact_count(key):
+    kind, value = key.split(':', 1)
+    if kind == 'status':
+        return Post.objects.filter(status=value).count()
+    return Post.published.filter(tags__id=int(value)).count()
+
+
+# Create a counter with an exact count, unless it exists already
+# - (INSERT ... ON CONFLICT DO NOTHING). Returns whether it was created.
+def seed(key):
+    table = PostCounter._meta.db_table
+    connection = connections[router.db_for_write(PostCounter)]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(table)} ({quote("key")}, {quote("value")}) VALUES (%s, %s) '
+            f'ON CONFLICT ({quote("key")}) DO NOTHING',
+            [key, exact_count(key)],
+        )
+        return cursor.rowcount == 1
+
+
+# Return the value of a counter: from the cache, then from the counter
+# - table, and only if the counter doesn't exist yet from a real COUNT(*).
+def get_count(key):
+    value = cache.get(_cache_key(key))
+    if value is None:
+        value = PostCounter.objects.filter(key=key).values_list('value', flat=True).first()
+        if value is None:
+            seed(key)
+            # Another transaction may have seeded it first.
+            value = PostCounter.objects.filter(key=key).values_list('value', flat=True).first()
+        cache.set(_cache_key(key), value, getattr(settings, 'BLOG_COUNTER_CACHE_TIMEOUT', 60))
+    return value
+
+
+# Apply a {key: delta} mapping to the counter table, in the transaction that made
+# - the change. The cached values are dropped once it commits.
+def apply_deltas(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    for key, delta in deltas.items():
+        if PostCounter.objects.filter(key=key).update(value=F('value') + delta):
+            continue
+        # The counter doesn't exist yet. Seeding it here counts this change already;
+        # - if another transaction seeded it first, its count couldn't see this
+        # - (uncommitted) change, so the delta still has to be added.
+        if not seed(key):
+            PostCounter.objects.filter(key=key).update(value=F('value') + delta)
+    keys = [_cache_key(key) for key in deltas]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# Forget a counter, for example when its tag has been deleted.
+def drop(key):
+    PostCounter.objects.filter(key=key).delete()
+    transaction.on_commit(lambda: cache.delete(_cache_key(key)))
+
+
+# Whether the database of a queryset can estimate row counts (only PostgreSQL can).
+def can_estimate(queryset):
+    return connections[router.db_for_read(queryset.model)].vendor == 'postgresql'
+
+
+# Ask the PostgreSQL planner how many rows a queryset would return. This reads
+# - the table statistics instead of scanning, so it's only an estimate. Other
+# - databases have no cheap equivalent and get an exact count.
+def estimated_count(queryset):
+    connection = connections[router.db_for_read(queryset.model)]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+# Count the posts of a queryset as cheaply as possible. With BLOG_ESTIMATED_COUNTS
+# - the planner estimate is used for big results; otherwise the matching
+# - counter (if any) answers, and only arbitrary querysets are counted exactly.
+def count_posts(queryset, key=None):
+    if getattr(settings, 'BLOG_ESTIMATED_COUNTS', False) and can_estimate(queryset):
+        estimate = estimated_count(queryset)
+        # Estimates are too rough for small tables, so count those exactly.
+        if estimate >= getattr(settings, 'BLOG_ESTIMATED_COUNT_THRESHOLD', 100000):
+            return estimate
+    if key is not None:
+        return get_count(key)
+    return queryset.count()
+
+
+####
+# Comment counters
+####
+
+# Add to the comment counters of a post.
+def add_comments(post_id, total=0, active=0):
+    if total or active:
+        Post.objects.filter(pk=post_id).update(
+            comment_count=F('comment_count') + total,
+            active_comment_count=F('active_comment_count') + active,
+        )
+
+
+# Add to the comment counters of many posts ({post id: (total, active)}) with a
+# - single UPDATE, for bulk moderation.
+def add_comments_many(deltas):
+    deltas = {pk: delta for pk, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    def case(position):
+        return Case(
+            *[When(pk=pk, then=Value(delta[position])) for pk, delta in deltas.items()],
+            default=Value(0), output_field=IntegerField(),
+        )
+
+    Post.objects.filter(pk__in=deltas).update(
+        comment_count=F('comment_count') + case(0),
+        active_comment_count=F('active_comment_count') + case(1),
+    )
+
+
+# Recount the comment counters of the given posts from the comments table with one
+# - grouped query, and write them back with one bulk update.
+def recount_comments(post_ids):
+    counts = {
+        row['post_id']: row
+        for row in Comment.objects.filter(post_id__in=post_ids).order_by().values('post_id').annotate(
+            total=Count('id'), active=Count('id', filter=Q(active=True)),
+        )
+    }
+    posts = list(Post.objects.filter(pk__in=post_ids).only('id', 'comment_count', 'active_comment_count'))
+    for post in posts:
+        row = counts.get(post.pk, {'total': 0, 'active': 0})
+        post.comment_count = row['total']
+        post.active_comment_count = row['active']
+    Post.objects.bulk_update(posts, ['comment_count', 'active_comment_count'])
+    return len(posts)
@@ -0,0 +1,154 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import DigestRun, Post, Subscriber
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIGEST = {
+    'DAYS': 7,
+    'CHUNK_SIZE': 100,
+    'WORKERS': 4,
+    'FROM_EMAIL': 'admin@myblog.com',
+    'PROTOCOL': 'https',
+}
+
+
+def digest_settings():
+    return {**DEFAULT_DIGEST, **getattr(settings, 'BLOG_DIGEST', {})}
+
+
+# The unfinished run to resume, or a new one covering the posts published since
+# - the previous run (the last DAYS days for the first one).
+def current_run(options=None):
+    options = options or digest_settings()
+    run = DigestRun.objects.filter(finished__isnull=True).order_by('id').first()
+    if run is None:
+        now = timezone.now()
+        previous = DigestRun.objects.filter(finished__isnull=False).order_by('-until').first()
+        since = previous.until if previous else now - timedelta(days=options['DAYS'])
+        run = DigestRun.objects.create(since=since, until=now)
+    return run
+
+
+def digest_posts(run):
+    return list(
+        Post.published.filter(publish__gt=run.since, publish__lte=run.until)
+        .order_by('-publish')
+        .defer('body_html', 'search_vector')
+    )
+
+
+# Render the digest once per format, as {format: (subject, text, html or None)}.
+# - Only the recipient differs from one subscriber to the next.
+def render_digest(posts, options=None):
+    options = options or digest_settings()
+    context = {
+        'posts': posts,
+        'site_url': f"{options['PROTOCOL']}://{Site.objects.get_current().domain}",
+    }
+    subject = f'{len(posts)} new post{"s" if len(posts) != 1 else ""} on My Blog'
+    text = render_to_string('blog/digest/digest.txt', context)
+    html = render_to_string('blog/digest/digest.html', context)
+    return {'text': (subject, text, None), 'html': (subject, text, html)}
+
+
+# The active subscribers after the checkpoint, as lists of (id, email, format) of
+# - CHUNK_SIZE subscribers, read one chunk at a time.
+def subscriber_chunks(after, size):
+    while True:
+        chunk = list(
+            Subscriber.objects.filter(active=True, id__gt=after)
+            .order_by('id')
+            .values_list('id', 'email', 'format')[:size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+# Send the digest to one chunk of subscribers over a single connection, the way
+# - send_mass_mail() does, and return the numbers of sent and failed messages. Runs
+# - in a worker thread and doesn't touch the database. A refused recipient is
+# - logged and skipped, so one bad address never holds the run back; if the
+# - connection can't be opened again after a failure the server is gone and the
+# - error is raised, so the chunk is sent again when the run is resumed.
+def send_chunk(chunk, rendered, from_email):
+    connection = get_connection()
+    sent = failed = 0
+    connection.open()
+    try:
+        for _, email, variant in chunk:
+            subject, text, html = rendered[variant]
+            if html is None:
+                message = EmailMessage(subject, text, from_email, [email], connection=connection)
+            else:
+                message = EmailMultiAlternatives(subject, text, from_email, [email], connection=connection)
+                message.attach_alternative(html, 'text/html')
+            try:
+                if connection.send_messages([message]) != 1:
+                    raise RuntimeError('The email backend did not send the message.')
+            except Exception as error:
+                logger.warning('Sending the digest to %s failed: %s', email, error)
+                failed += 1
+                connection.close()
+                connection.open()
+            else:
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+# Send the current digest run to every active subscriber and return
+# - (run, messages sent, seconds). Chunks are sent by a pool of WORKERS threads; the
+# - checkpoint moves past a chunk once it and every chunk before it are done, so a
+# - crash resends at most the chunks that were in flight. Messages the server
+# - refused are counted in run.failed and not retried. `progress` is called with
+# - (sent, seconds) after every chunk.
+def send_digest(workers=None, chunk_size=None, progress=None):
+    options = digest_settings()
+    workers = workers or options['WORKERS']
+    chunk_size = chunk_size or options['CHUNK_SIZE']
+    run = current_run(options)
+    posts = digest_posts(run)
+    started = time.monotonic()
+    sent = 0
+    if posts:
+        rendered = render_digest(posts, options)
+        chunks = subscriber_chunks(run.last_subscriber, chunk_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep a few chunks per worker in flight, so the subscribers are never all in memory.
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk[-1][0], executor.submit(send_chunk, chunk, rendered, options['FROM_EMAIL'])))
+                if len(pending) >= workers * 2:
+                    sent += _checkpoint(run, *pending.popleft())
+                    if progress:
+                        progress(sent, time.monotonic() - started)
+            while pending:
+                sent += _checkpoint(run, *pending.popleft())
+                if progress:
+                    progress(sent, time.monotonic() - started)
+    DigestRun.objects.filter(pk=run.pk).update(finished=timezone.now())
+    return run, sent, time.monotonic() - started
+
+
+# Wait for a chunk and record it as done. Returns the number of messages sent.
+def _checkpoint(run, last_subscriber, future):
+    sent, failed = future.result()
+    DigestRun.objects.filter(pk=run.pk).update(
+        last_subscriber=last_subscriber, sent=F('sent') + sent, failed=F('failed') + failed,
+    )
+    return sent
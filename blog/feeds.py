@@ -1,10 +1,85 @@
+import hashlib
+from calendar import timegm
+
+from django.conf import settings
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.template.defaultfilters import truncatewords
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import http_date, quote_etag
+
+from taggit.models import Tag
 
+from .cache import FEED_GENERATION, get_generation
 from .models import Post
 
 
+def feed_cache_timeout():
+    return getattr(settings, 'BLOG_FEED_CACHE_TIMEOUT', 86400)
+
+
+# The serialized feed of the current feed generation, from the shared cache. It's
+# - built again only after a post is published, edited or unpublished (the signal
+# - handlers bump the generation), however often feed readers poll.
+def cached_feed(name, build):
+    key = f'blog:feed:{get_generation(FEED_GENERATION)}:{name}'
+    feed = cache.get(key)
+    if feed is None:
+        feed = build()
+        cache.set(key, feed, feed_cache_timeout())
+    return feed
+
+
+####
+# Feed items
+####
+
+# An item is keyed by its post and the post's last update, so an edited post gets
+# - a new entry and every feed (RSS or Atom, global or per tag) shares the others.
+def _item_key(pk, updated):
+    return f'blog:feed:item:{pk}:{timegm(updated.utctimetuple())}.{updated.microsecond}'
+
+
+# The fields of a feed item, rendered once per version of the post.
+def render_item(post):
+    return {
+        'title': post.title,
+        'link': post.get_absolute_url(),
+        # - Use the truncatewords built-in template filter to build the description of the blog post with the
+        # -  first 30 words.
+        'description': truncatewords(post.body, 30),
+        'pubdate': post.publish,
+        'updateddate': post.updated,
+    }
+
+
+# The rendered items of the given posts (newest first, at most `limit`). Only the
+# - ids and update dates are queried; the posts whose items aren't cached yet are
+# - loaded and rendered together.
+def feed_items(posts, limit):
+    rows = list(posts.order_by('-publish', '-pk').values_list('id', 'updated')[:limit])
+    keys = {pk: _item_key(pk, updated) for pk, updated in rows}
+    items = cache.get_many(keys.values())
+    missing = [pk for pk, key in keys.items() if key not in items]
+    if missing:
+        rendered = {
+            keys[post.pk]: render_item(post)
+            for post in Post.objects.filter(pk__in=missing).defer('body_html', 'excerpt_html', 'search_vector')
+        }
+        cache.set_many(rendered, feed_cache_timeout())
+        items.update(rendered)
+    return [items[keys[pk]] for pk, _ in rows if keys[pk] in items]
+
+
+####
+# Feeds
+####
+
 # First subclass the Feed class of the syndication framework
 class LatestPostFeed(Feed):
     # The title, link, and description attributes correspond to the
@@ -12,18 +87,87 @@ class LatestPostFeed(Feed):
     title = "My Blog"
     link = reverse_lazy('blog:post_list')  # reverse_lazy() to generate the URL for the link attribute
     description = 'New posts of my blog.'
+    # Number of posts in the feed.
+    limit = 5
 
     # The items() method retrieves the objects to be included in the feed. You are retrieving only the
-    # - last five published posts for this feed.
+    # - last five published posts for this feed, as pre-rendered items.
     def items(self):
-        return Post.published.all()[:5]
+        return feed_items(Post.published.all(), self.limit)
 
     #  The item_title() and item_description() methods will receive each object returned by items()
     #  - and return the title and description for each item.
     def item_title(self, item):
-        return item.title
+        return item['title']
 
-    # - Use the truncatewords built-in template filter to build the description of the blog post with the
-    # -  first 30 words.
     def item_description(self, item):
-        return truncatewords(item.body, 30)
+        return item['description']
+
+    def item_link(self, item):
+        return item['link']
+
+    def item_pubdate(self, item):
+        return item['pubdate']
+
+    def item_updateddate(self, item):
+        return item['updateddate']
+
+    # Name of the feed in the cache. The URL arguments are part of it.
+    def cache_name(self, **kwargs):
+        return ':'.join([self.feed_type.__name__, *(str(value) for value in kwargs.values())])
+
+    # Serve the feed from the cache with a strong ETag and a Last-Modified date, so
+    # - a conditional request from a feed reader gets a 304 without a database query.
+    def __call__(self, request, *args, **kwargs):
+        feed = cached_feed(self.cache_name(**kwargs), lambda: self.build(request, *args, **kwargs))
+        response = get_conditional_response(request, etag=feed['etag'], last_modified=feed['last_modified'])
+        if response is None:
+            response = HttpResponse(feed['content'], content_type=feed['content_type'])
+        response['ETag'] = feed['etag']
+        if feed['last_modified'] is not None:
+            response['Last-Modified'] = http_date(feed['last_modified'])
+        return response
+
+    # Render the feed. Its validators come from the newest Post.updated: every save
+    # - moves it forward, drafts included, so unpublishing a post does too.
+    def build(self, request, *args, **kwargs):
+        updated = Post.objects.aggregate(updated=Max('updated'))['updated']
+        response = super().__call__(request, *args, **kwargs)
+        content = response.content
+        stamp = updated.isoformat() if updated else ''
+        return {
+            'content': content,
+            'content_type': response['Content-Type'],
+            'etag': quote_etag(hashlib.sha1(stamp.encode() + content).hexdigest()),
+            'last_modified': timegm(updated.utctimetuple()) if updated else None,
+        }
+
+
+class LatestPostAtomFeed(LatestPostFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostFeed.description
+
+
+# The latest posts with one tag.
+class TagPostFeed(LatestPostFeed):
+    def get_object(self, request, tag_slug):
+        return get_object_or_404(Tag, slug=tag_slug)
+
+    def title(self, tag):
+        return f'My Blog: posts tagged "{tag.name}"'
+
+    def link(self, tag):
+        return reverse('blog:post_list_by_tag', args=[tag.slug])
+
+    def description(self, tag):
+        return f'New posts of my blog tagged "{tag.name}".'
+
+    def items(self, tag):
+        return feed_items(Post.published.filter(tags__id=tag.id), self.limit)
+
+
+class TagPostAtomFeed(TagPostFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, tag):
+        return self.description(tag)
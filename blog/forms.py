@@ -20,3 +20,6 @@ class CommentForm(forms.ModelForm):
 # Search form
 class SearchForm(forms.Form):
     query = forms.CharField()
+    # Facet filters, set by the tag and year links of the results page.
+    tag = forms.SlugField(required=False, widget=forms.HiddenInput)
+    year = forms.IntegerField(required=False, min_value=1, max_value=9999, widget=forms.HiddenInput)
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+from django.db import connection
+
+from .cache import bump_generation, get_generation
+
+logger = logging.getLogger(__name__)
+
+
+# Base class of the in-process indexes (tag index, BM25 search index). An index is
+# - built from the database in a background thread, kept up to date in this process
+# - by the signal handlers in blog/signals.py, and tied to a generation counter in the
+# - shared cache: when another process changed the data, the generations no longer
+# - match, the index reports itself cold and rebuilds in the background.
+# Subclasses implement load() (read the database), install() (swap in what load()
+# - returned) and apply() (one incremental change).
+class InMemoryIndex:
+    # Name of the generation counter of the index.
+    generation_name = None
+    # Used in the name of the rebuild thread and in log messages.
+    label = 'index'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._generation = None
+        self._building = False
+        self._pending = []
+
+    # Whether the index is in use at all.
+    def enabled(self):
+        return True
+
+    # True once the index has been built, even if it's stale now.
+    @property
+    def built(self):
+        return self._generation is not None
+
+    # True when the index can answer queries.
+    @property
+    def warm(self):
+        if not self.enabled() or self._generation is None:
+            return False
+        if self._generation != get_generation(self.generation_name):
+            # Another process changed the data; start over in the background.
+            self.rebuild_in_background()
+            return False
+        return True
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild_thread, name=f'blog-{self.label}', daemon=True).start()
+
+    def _rebuild_thread(self):
+        try:
+            self.rebuild()
+        finally:
+            # The thread got its own database connection; don't leave it open.
+            connection.close()
+
+    # Load the whole index from the database.
+    def rebuild(self):
+        with self._lock:
+            self._building = True
+            self._pending = []
+        try:
+            generation = get_generation(self.generation_name)
+            state = self.load()
+        except Exception:
+            logger.exception('Could not build the %s', self.label)
+            with self._lock:
+                self._building = False
+            return
+
+        with self._lock:
+            self.install(state)
+            # Changes made while the database was being read are applied again.
+            for args in self._pending:
+                self.apply(*args)
+            self._pending = []
+            self._generation = generation
+            self._building = False
+        logger.info('%s built: %s', self.label.capitalize(), self.describe())
+
+    def load(self):
+        raise NotImplementedError
+
+    def install(self, state):
+        raise NotImplementedError
+
+    def apply(self, *args):
+        raise NotImplementedError
+
+    # Summary of the index for the log.
+    def describe(self):
+        return ''
+
+    # Apply a change in this process, and in every other process through the generation.
+    # - Changes arriving during a rebuild are replayed on top of it.
+    def update(self, *args):
+        with self._lock:
+            if self._building:
+                self._pending.append(args)
+            self.apply(*args)
+            self.advance()
+
+    # Apply several changes with a single move to the next generation, for bulk actions.
+    def update_many(self, changes):
+        with self._lock:
+            for args in changes:
+                if self._building:
+                    self._pending.append(args)
+                self.apply(*args)
+            self.advance()
+
+    # Move to the next generation. If another process got there in between, this
+    # - index missed its change and has to be rebuilt.
+    def advance(self):
+        generation = bump_generation(self.generation_name)
+        if self._generation is not None and generation == self._generation + 1:
+            self._generation = generation
+        else:
+            self._generation = None
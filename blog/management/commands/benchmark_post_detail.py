@@ -0,0 +1,88 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.models import Post
+
+
+class Rollback(Exception):
+    pass
+
+
+# Measure how the post_detail lookup behaves as the posts table grows. Posts are
+# - added in a transaction that is rolled back at the end, so it's safe to run
+# - against a development database (the tables must exist).
+class Command(BaseCommand):
+    help = 'Benchmark the post_detail lookup against growing numbers of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+            help='Total numbers of posts to measure at.',
+        )
+        parser.add_argument(
+            '--lookups', type=int, default=200,
+            help='Number of lookups timed at every size.',
+        )
+        parser.add_argument(
+            '--slugs', type=int, default=50,
+            help='Number of distinct slugs, so many posts share each slug like in a real archive.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write('Benchmark posts rolled back.')
+
+    def run(self, options):
+        author, _ = User.objects.get_or_create(username='benchmark-author')
+        start = timezone.now()
+        created = 0
+        self.stdout.write(f'{"posts":>10} {"range (ms)":>12} {"extract (ms)":>14}')
+        for size in sorted(options['sizes']):
+            # bulk_create() skips save() and the signals; only the lookup is measured.
+            Post.objects.bulk_create([
+                Post(
+                    title=f'Benchmark post {i}',
+                    slug=f'benchmark-post-{i % options["slugs"]}',
+                    author=author,
+                    body='Benchmark body.',
+                    status='published',
+                    publish=start - timedelta(hours=i),
+                )
+                for i in range(created, size)
+            ], batch_size=500)
+            created = max(created, size)
+            targets = list(
+                Post.published.filter(author=author).order_by('?').values_list('slug', 'publish')[:options['lookups']]
+            )
+            self.stdout.write(
+                f'{size:>10} {self.time(targets, self.range_lookup):>12.3f} '
+                f'{self.time(targets, self.extract_lookup):>14.3f}'
+            )
+
+    # Median time of a lookup, in milliseconds.
+    def time(self, targets, lookup):
+        timings = []
+        for slug, publish in targets:
+            publish = timezone.localtime(publish)
+            began = time.perf_counter()
+            lookup(slug, publish.year, publish.month, publish.day)
+            timings.append((time.perf_counter() - began) * 1000)
+        return statistics.median(timings)
+
+    # The lookup post_detail uses.
+    def range_lookup(self, slug, year, month, day):
+        return Post.published.on_date(year, month, day).get(slug=slug)
+
+    # The previous lookup, for comparison.
+    def extract_lookup(self, slug, year, month, day):
+        return Post.published.get(slug=slug, publish__year=year, publish__month=month, publish__day=day)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from blog.search.vocabulary import build_vocabulary
+
+
+# Rebuild the vocabulary behind the "did you mean" search suggestions. Run it
+# - periodically (e.g. nightly); new words only become suggestions after it ran.
+class Command(BaseCommand):
+    help = 'Rebuild the search vocabulary used for "did you mean" suggestions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of words inserted per query.',
+        )
+
+    def handle(self, *args, **options):
+        count = build_vocabulary(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {count} search terms.'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from blog.sitemaps import build_sitemaps
+
+
+# Write the gzipped sitemap files of the sections whose posts changed since the last
+# - run, and the sitemap index. Meant to be run from cron.
+class Command(BaseCommand):
+    help = 'Write the sitemap index and the sitemap sections whose posts changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Write every section, not only the ones whose posts changed.',
+        )
+
+    def handle(self, *args, **options):
+        written = build_sitemaps(force=options['all'])
+        sections = ', '.join(str(number) for number in written) or 'none'
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(written)} sitemap sections ({sections}).'))
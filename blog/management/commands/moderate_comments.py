@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from blog.models import Comment
+from blog.moderation import delete_comments, set_comments_active
+
+
+# Approve, deactivate or delete every comment matching some filters, in batches,
+# - e.g. to clean up after a spam wave:
+# - manage.py moderate_comments delete --email spammer@example.com
+class Command(BaseCommand):
+    help = 'Approve, deactivate or delete the comments matching the given filters in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['approve', 'deactivate', 'delete'])
+        parser.add_argument('--post', type=int, help='Only the comments of this post id.')
+        parser.add_argument('--email', help='Only the comments with this email address.')
+        parser.add_argument('--name', help='Only the comments with this name.')
+        parser.add_argument('--contains', help='Only the comments whose body contains this text.')
+        parser.add_argument('--since', help='Only the comments created at or after this datetime.')
+        parser.add_argument('--until', help='Only the comments created before this datetime.')
+        parser.add_argument('--batch-size', type=int, help='Number of comments changed per statement.')
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Only report how many comments match.',
+        )
+
+    def handle(self, *args, **options):
+        queryset = Comment.objects.all()
+        filters = {
+            'post': 'post_id', 'email': 'email__iexact', 'name': 'name', 'contains': 'body__icontains',
+        }
+        for option, lookup in filters.items():
+            if options[option] is not None:
+                queryset = queryset.filter(**{lookup: options[option]})
+        for option, lookup in [('since', 'created__gte'), ('until', 'created__lt')]:
+            if options[option] is not None:
+                value = parse_datetime(options[option])
+                if value is None:
+                    raise CommandError(f'--{option} must be a datetime, e.g. 2020-01-31T12:00:00Z.')
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+
+        if options['dry_run']:
+            self.stdout.write(f'{queryset.count()} comments match.')
+            return
+        action = options['action']
+        if action == 'delete':
+            count = delete_comments(queryset, options['batch_size'])
+        else:
+            count = set_comments_active(queryset, action == 'approve', options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{action.capitalize()}d {count} comments.'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import Post, SimilarPost
+from blog.similarity import rebuild_similar_posts
+
+
+# Recompute the whole SimilarPost table, e.g. after the first deploy or after
+# - changing BLOG_SIMILAR_POSTS_KEPT. Day to day the signal handlers keep it current.
+class Command(BaseCommand):
+    help = 'Recompute the precomputed similar posts of every published post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=200,
+            help='Number of posts recomputed per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        # Rows involving unpublished posts shouldn't exist, but a rebuild fixes anything.
+        SimilarPost.objects.exclude(post__status='published').delete()
+        SimilarPost.objects.exclude(similar__status='published').delete()
+
+        done = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                Post.published.filter(id__gt=last_id).only('id', 'status').order_by('id')[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            with transaction.atomic():
+                for post in chunk:
+                    rebuild_similar_posts(post)
+            done += len(chunk)
+            last_id = chunk[-1].id
+            self.stdout.write(f'Recomputed {done} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Recomputed the similar posts of {done} posts.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from blog.counters import recount_comments
+from blog.models import Post
+
+
+# Repair the denormalized comment counters of the posts from the comments table.
+class Command(BaseCommand):
+    help = 'Recount Post.comment_count and Post.active_comment_count in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of posts recounted per grouped query.',
+        )
+
+    def handle(self, *args, **options):
+        done = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            done += recount_comments(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Recounted {done} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Recounted the comments of {done} posts.'))
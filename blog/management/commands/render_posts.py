@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.rendering import render_excerpt, render_markdown, render_signature
+
+
+# Re-render the stored HTML of the posts in batches, e.g. after changing
+# - BLOG_MARKDOWN_EXTENSIONS or upgrading Markdown.
+class Command(BaseCommand):
+    help = 'Render the markdown body of posts into their stored HTML fields.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of posts rendered and written per batch.',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Render every post, not only the ones rendered by an older markdown setup.',
+        )
+
+    def handle(self, *args, **options):
+        signature = render_signature()
+        queryset = Post.objects.only('id', 'body').order_by('id')
+        if not options['all']:
+            queryset = queryset.exclude(render_signature=signature)
+
+        rendered = 0
+        last_id = 0
+        while True:
+            # Walk the table by primary key so every batch is an index range scan.
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for post in batch:
+                post.body_html = render_markdown(post.body)
+                post.excerpt_html = render_excerpt(post.body_html)
+                post.render_signature = signature
+            # bulk_update() doesn't call save(), so `updated` is left alone.
+            Post.objects.bulk_update(batch, ['body_html', 'excerpt_html', 'render_signature'])
+            rendered += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f'Rendered {rendered} posts...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} posts.'))
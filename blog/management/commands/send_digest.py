@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from blog.digest import send_digest
+
+
+# Email the digest of the posts published since the last digest to every active
+# - subscriber. An interrupted run is resumed from its checkpoint by the next one.
+class Command(BaseCommand):
+    help = 'Send the digest of new posts to the subscribers, resuming an unfinished run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            help='Number of sending threads, each with one email connection (default: BLOG_DIGEST WORKERS).',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int,
+            help='Number of subscribers sent to over one connection (default: BLOG_DIGEST CHUNK_SIZE).',
+        )
+
+    def handle(self, *args, **options):
+        def progress(sent, seconds):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Sent {sent} digests ({rate(sent, seconds):.1f} messages/s)...')
+
+        run, sent, seconds = send_digest(options['workers'], options['chunk_size'], progress)
+        run.refresh_from_db()
+        self.stdout.write(self.style.SUCCESS(
+            f'{run}: sent {sent} digests in {seconds:.1f}s ({rate(sent, seconds):.1f} messages/s), '
+            f'{run.sent} in total, {run.failed} failed.'
+        ))
+
+
+def rate(sent, seconds):
+    return sent / seconds if seconds else 0.0
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.outbox import drain_outbox, outbox_settings
+
+
+# Send the queued emails of the outbox (see blog/outbox.py). Run it from cron, or
+# - keep it running with --loop.
+class Command(BaseCommand):
+    help = 'Send the queued outbox emails in batches, retrying failed ones with a backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            help='Number of workers, each with one email connection (default: BLOG_OUTBOX WORKERS).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Number of emails a worker claims at a time (default: BLOG_OUTBOX BATCH_SIZE).',
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling the outbox instead of exiting once it is drained.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds between two polls with --loop.',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'] or outbox_settings()['WORKERS'], 1)
+        while True:
+            sent, failed = drain_outbox(workers, options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
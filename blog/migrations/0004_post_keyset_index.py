@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_post_tags'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', 'publish', 'id'], name='blog_post_status_5ab365_idx'),
+        ),
+    ]
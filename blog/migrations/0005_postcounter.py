@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_post_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True)),
+                ('value', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_postcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='render_signature',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_body_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('similar_publish', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_posts', to='blog.Post')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='blog.Post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='similarpost',
+            index=models.Index(fields=['post', '-score', '-similar_publish'], name='blog_simila_post_id_2954c4_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='similarpost',
+            unique_together={('post', 'similar')},
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:51
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Fill in the new counters from the existing comments in one UPDATE statement.
+def count_comments(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+
+    def counted(**filters):
+        return Coalesce(Subquery(
+            Comment.objects.filter(post=OuterRef('pk'), **filters).order_by().values('post').annotate(
+                total=Count('id'),
+            ).values('total'),
+            output_field=IntegerField(),
+        ), 0)
+
+    Post.objects.update(comment_count=counted(), active_comment_count=counted(active=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_similarpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='active_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-comment_count'], name='blog_post_status_d07366_idx'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_post_comment_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(status='published'), fields=['slug', 'publish'], name='blog_post_published_slug_idx'),
+        ),
+    ]
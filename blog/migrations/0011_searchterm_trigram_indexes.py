@@ -0,0 +1,48 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+# Trigram GIN indexes, so the % (similarity) operator is answered from an index
+# - instead of comparing the query with every row.
+TRIGRAM_INDEXES = [
+    ('blog_post_title_trgm_idx', 'blog_post', 'title'),
+    ('taggit_tag_name_trgm_idx', 'taggit_tag', 'name'),
+    ('blog_searchterm_word_trgm_idx', 'blog_searchterm', 'word'),
+]
+
+
+# pg_trgm and its indexes only exist on PostgreSQL; other databases skip fuzzy search.
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX {name} ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+# The extension is left installed, something else may use it.
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_post_search_vector'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=100, unique=True)),
+                ('documents', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:17
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Number of comments whose search vector is filled in per UPDATE statement.
+BATCH_SIZE = 1000
+
+# The search document of a comment: the name and email (weight A) and the body (weight B).
+SEARCH_DOCUMENT = """
+    setweight(to_tsvector(coalesce({row}name, '') || ' ' || coalesce({row}email, '')), 'A') ||
+    setweight(to_tsvector(coalesce({row}body, '')), 'B')
+"""
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION blog_comment_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_DOCUMENT.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER blog_comment_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, email, body ON blog_comment
+    FOR EACH ROW EXECUTE PROCEDURE blog_comment_search_vector_update();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS blog_comment_search_vector_update ON blog_comment;
+DROP FUNCTION IF EXISTS blog_comment_search_vector_update();
+"""
+
+
+# Like the post search vector (0010), the comment search vector, its trigger and its
+# - GIN index only exist on PostgreSQL.
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+# Fill in the search vector of the existing comments in primary key batches, each in
+# - its own transaction.
+def backfill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Comment = apps.get_model('blog', 'Comment')
+    last_id = 0
+    while True:
+        ids = list(Comment.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        schema_editor.execute(
+            f'UPDATE blog_comment SET search_vector = {SEARCH_DOCUMENT.format(row="")} WHERE id >= %s AND id <= %s',
+            [ids[0], ids[-1]],
+        )
+        last_id = ids[-1]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX blog_comment_search_vector_idx ON blog_comment USING gin (search_vector)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS blog_comment_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+    # Every backfill batch commits on its own.
+    atomic = False
+
+    dependencies = [
+        ('blog', '0013_subscriber_digestrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_comment_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digestrun',
+            name='failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
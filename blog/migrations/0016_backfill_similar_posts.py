@@ -0,0 +1,61 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:05
+
+import heapq
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations
+
+# Number of SimilarPost rows inserted per query.
+BATCH_SIZE = 1000
+
+
+# Fill the SimilarPost table for the posts that existed before it, like
+# - `manage.py rebuild_similar_posts` does (see blog/similarity.py): for every published
+# - post, the published posts sharing the most tags with it, then the newest ones. The
+# - tags of the published posts are read once and the overlaps counted in Python.
+def backfill_similar_posts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    SimilarPost = apps.get_model('blog', 'SimilarPost')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    kept = getattr(settings, 'BLOG_SIMILAR_POSTS_KEPT', 10)
+
+    published = dict(Post.objects.filter(status='published').values_list('id', 'publish').iterator())
+    post_tags = {}
+    tag_posts = {}
+    if published:
+        tagged = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post),
+        ).values_list('object_id', 'tag_id')
+        for post_id, tag_id in tagged.iterator():
+            if post_id in published:
+                post_tags.setdefault(post_id, []).append(tag_id)
+                tag_posts.setdefault(tag_id, []).append(post_id)
+
+    SimilarPost.objects.all().delete()
+    rows = []
+    for post_id, tag_ids in post_tags.items():
+        shared = Counter(pk for tag_id in tag_ids for pk in tag_posts[tag_id] if pk != post_id)
+        best = heapq.nlargest(kept, shared.items(), key=lambda item: (item[1], published[item[0]]))
+        rows.extend(
+            SimilarPost(post_id=post_id, similar_id=pk, similar_publish=published[pk], score=score)
+            for pk, score in best
+        )
+        if len(rows) >= BATCH_SIZE:
+            SimilarPost.objects.bulk_create(rows)
+            rows = []
+    SimilarPost.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_digestrun_failed'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_similar_posts, migrations.RunPython.noop),
+    ]
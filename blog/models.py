@@ -1,9 +1,15 @@
+import datetime
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils.safestring import mark_safe
 from taggit.managers import TaggableManager
 
+from .rendering import render_excerpt, render_markdown, render_markdown_cached, render_signature
+
 
 # Published custom post manager model
 class PublishedManager(models.Manager):
@@ -11,6 +17,28 @@ class PublishedManager(models.Manager):
     def get_queryset(self):
         return super(PublishedManager, self).get_queryset().filter(status='published')
 
+    # Posts published on the given day of the current time zone. The day is turned into a
+    # - half-open [midnight, next midnight) range on publish, which unlike publish__year,
+    # - publish__month and publish__day (EXTRACT() in SQL) can use an index.
+    # - Raises ValueError (or OverflowError) for dates that don't exist.
+    def on_date(self, year, month, day):
+        start = datetime.datetime(year, month, day)
+        current_timezone = timezone.get_current_timezone()
+        return self.get_queryset().filter(
+            publish__gte=timezone.make_aware(start, current_timezone, is_dst=False),
+            publish__lt=timezone.make_aware(start + datetime.timedelta(days=1), current_timezone, is_dst=False),
+        )
+
+
+# Leave the markdown body of the posts of a list out of the query, except for the posts
+# - whose stored HTML is stale (rendered by an older markdown setup): their body is
+# - selected as `stale_body`, so rendering them on the fly doesn't cost a query per post.
+def defer_body(queryset):
+    return queryset.defer('body').annotate(stale_body=models.Case(
+        models.When(~models.Q(render_signature=render_signature()), then=models.F('body')),
+        output_field=models.TextField(),
+    ))
+
 
 # Post model
 class Post(models.Model):
@@ -33,6 +61,12 @@ class Post(models.Model):
         related_name='blog_posts'
     )
     body = models.TextField()
+    # The body rendered from markdown to HTML and the excerpt shown on the post list. Both are
+    # - rebuilt on save, so templates don't have to run markdown on every request.
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
+    # Fingerprint of the markdown version and extensions body_html was rendered with.
+    render_signature = models.CharField(max_length=16, blank=True, editable=False)
     # This datetime indicates when the post was published. You use Django's timezone now method as the default value.
     # - This returns the current datetime in a timezone-aware format.
     publish = models.DateTimeField(default=timezone.now)
@@ -44,6 +78,14 @@ class Post(models.Model):
     updated = models.DateTimeField(auto_now=True)
     # Set default status of post to 'draft'
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')
+    # Denormalized number of comments (all of them, and only the active ones). They are kept
+    # - up to date by the comment signal handlers in blog/signals.py; `manage.py recount_comments`
+    # - repairs them.
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    active_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Full-text search document: the title (weight A) and the body (weight B). On PostgreSQL a
+    # - trigger keeps it current on every insert and update, and a GIN index serves post_search.
+    search_vector = SearchVectorField(null=True, editable=False)
     # Default manager
     objects = models.Manager()
     # Custom manager
@@ -53,10 +95,72 @@ class Post(models.Model):
 
     class Meta:
         ordering = ('-publish',)
+        indexes = [
+            # Serves the keyset pagination of published posts on (publish, id)
+            # - in both directions without a sort.
+            models.Index(fields=['status', 'publish', 'id']),
+            # Turns "most commented posts" into a top-N index scan.
+            models.Index(fields=['status', '-comment_count']),
+            # Serves the (slug, publish day range) lookup of post_detail, for published posts only.
+            models.Index(
+                fields=['slug', 'publish'],
+                name='blog_post_published_slug_idx',
+                condition=models.Q(status='published'),
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # The comment counters only change through F() updates (blog/signals.py). Writing
+            # - every field would put back the counts this instance was loaded with and
+            # - lose the comments added since, so an existing post is saved without them.
+            # - This makes such a save() an UPDATE only: saving a post whose row was deleted
+            # - in the meantime raises DatabaseError instead of inserting the row again.
+            skipped = self.get_deferred_fields() | {'comment_count', 'active_comment_count'}
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped and field.name not in skipped
+            ]
+        # The body is only rendered when it is written, so saving other fields neither
+        # - loads a deferred body nor renders markdown that would not be stored.
+        if update_fields is None or 'body' in update_fields:
+            self.render_body()
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'body_html', 'excerpt_html', 'render_signature'}
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+    # Render the markdown body into the stored HTML fields.
+    def render_body(self):
+        self.body_html = render_markdown(self.body)
+        self.excerpt_html = render_excerpt(self.body_html)
+        self.render_signature = render_signature()
+
+    # The stored HTML is only used while it matches the current markdown setup.
+    # - Stale posts are rendered on the fly until `manage.py render_posts` updates them.
+    @property
+    def rendered_body(self):
+        if self.render_signature != render_signature():
+            return mark_safe(render_markdown_cached(self.markdown_body))
+        return mark_safe(self.body_html)
+
+    @property
+    def rendered_excerpt(self):
+        if self.render_signature != render_signature():
+            return mark_safe(render_excerpt(render_markdown_cached(self.markdown_body)))
+        return mark_safe(self.excerpt_html)
+
+    # The markdown body, from `stale_body` when the post was loaded by defer_body().
+    @property
+    def markdown_body(self):
+        stale_body = getattr(self, 'stale_body', None)
+        return self.body if stale_body is None else stale_body
+
     # You will use the get_absolute_url() method in
     # - your templates to link to specific posts.
     def get_absolute_url(self):
@@ -82,9 +186,130 @@ class Comment(models.Model):
     updated = models.DateTimeField(auto_now=True)
     # Boolean field that you will use to manually deactivate inappropriate/unwanted comments.
     active = models.BooleanField(default=True)
+    # Full-text search document of the admin search: the name and email (weight A) and the
+    # - body (weight B), kept current by a trigger on PostgreSQL and served by a GIN index.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ('created',)
 
     def __str__(self):
         return f'Comment by {self.name} on {self.post}'
+
+
+# Denormalized post counters (posts per status and published posts per tag).
+# - They are kept up to date by the signal handlers in blog/signals.py, so
+# - pagination and the sidebar never have to run a COUNT(*) over the posts table.
+class PostCounter(models.Model):
+    key = models.CharField(max_length=50, unique=True)
+    value = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.key} = {self.value}'
+
+
+# Precomputed "similar posts": for every published post, the published posts that share
+# - the most tags with it. blog/similarity.py keeps the rows up to date when tags or
+# - statuses change, so post_detail reads its top 4 with a single indexed lookup.
+class SimilarPost(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_posts')
+    similar = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_to')
+    # Number of tags both posts share.
+    score = models.PositiveIntegerField()
+    # Copy of similar.publish, used to show recent posts first among equal scores.
+    similar_publish = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('post', 'similar')
+        indexes = [
+            models.Index(fields=['post', '-score', '-similar_publish']),
+        ]
+
+    def __str__(self):
+        return f'{self.similar} is similar to {self.post} ({self.score})'
+
+
+# Vocabulary of the published posts: every word of the titles, bodies and tag names
+# - with the number of posts using it. "Did you mean" suggestions are looked up here
+# - (see blog/search/vocabulary.py); `manage.py build_search_vocabulary` fills it in.
+class SearchTerm(models.Model):
+    word = models.CharField(max_length=100, unique=True)
+    documents = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.word
+
+
+# Outbox of the emails the site sends (e.g. post_share). Views only add a row here;
+# - `manage.py send_outbox` sends them in batches over reused connections and retries
+# - failures with a backoff (see blog/outbox.py).
+class OutboxMessage(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    # Comma separated recipient addresses.
+    recipients = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When the message is due: its next (re)try while queued, and the end of the worker's
+    # - lease while sending, after which another worker may claim it again.
+    next_attempt = models.DateTimeField(default=timezone.now)
+    # Token of the worker batch that claimed the message.
+    claim = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Serves the "due messages" lookup of the workers.
+            models.Index(fields=['status', 'next_attempt']),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.recipients}'
+
+    @property
+    def recipient_list(self):
+        return [address for address in self.recipients.split(',') if address]
+
+
+# A reader who gets the digest of new posts by email (see blog/digest.py).
+class Subscriber(models.Model):
+    FORMAT_CHOICES = (
+        ('text', 'Plain text'),
+        ('html', 'HTML'),
+    )
+
+    email = models.EmailField(unique=True)
+    # The digest is rendered once per format and sent to every subscriber of that format.
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES, default='html')
+    active = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.email
+
+
+# One digest sending: the posts published in (since, until] go to every active
+# - subscriber. Subscribers are sent to in id order and last_subscriber is the
+# - checkpoint, so `manage.py send_digest` resumes an unfinished run where it stopped.
+class DigestRun(models.Model):
+    since = models.DateTimeField()
+    until = models.DateTimeField()
+    last_subscriber = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    # Messages the mail server refused; they are logged and not sent again.
+    failed = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Digest of {self.since:%Y-%m-%d} to {self.until:%Y-%m-%d}'
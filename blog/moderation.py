@@ -0,0 +1,149 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import counters
+from .autocomplete import autocomplete_index
+from .models import Comment, Post
+from .search.bm25 import bm25_index
+from .signals import bump_feed, bump_search, bump_sidebar
+from .similarity import refresh_similar_posts_bulk
+from .tag_index import tag_index
+
+# Bulk moderation (the comment and post admin actions and `manage.py moderate_comments`).
+# - Rows are changed with one UPDATE or DELETE per batch, which sends no model signals,
+# - so every batch does the work of the signal handlers in blog/signals.py itself: once
+# - for the whole batch instead of once per row.
+
+
+def moderation_batch_size():
+    return getattr(settings, 'BLOG_MODERATION_BATCH_SIZE', 1000)
+
+
+# The ids of a queryset in batches, walking the primary key.
+def id_batches(queryset, batch_size=None):
+    batch_size = batch_size or moderation_batch_size()
+    ids = queryset.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+####
+# Comments
+####
+
+# Approve (active=True) or deactivate the comments of a queryset. Returns the number
+# - of comments changed.
+def set_comments_active(queryset, active, batch_size=None):
+    changed = 0
+    for batch in id_batches(queryset.filter(active=not active), batch_size):
+        with transaction.atomic():
+            rows = list(
+                Comment.objects.filter(id__in=batch, active=not active)
+                .order_by()
+                .select_for_update()
+                .values_list('id', 'post_id')
+            )
+            Comment.objects.filter(id__in=[pk for pk, _ in rows]).update(active=active, updated=timezone.now())
+            delta = 1 if active else -1
+            per_post = Counter(post_id for _, post_id in rows)
+            counters.add_comments_many({post_id: (0, delta * count) for post_id, count in per_post.items()})
+            bump_sidebar()
+        changed += len(rows)
+    return changed
+
+
+# DELETE the rows of a model by primary key, in one statement and without signals.
+def delete_rows(model, pks):
+    if not pks:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} '
+            f'IN ({", ".join(["%s"] * len(pks))})',
+            pks,
+        )
+
+
+# Delete the comments of a queryset. Returns the number of comments deleted.
+def delete_comments(queryset, batch_size=None):
+    deleted = 0
+    for batch in id_batches(queryset, batch_size):
+        with transaction.atomic():
+            rows = list(
+                Comment.objects.filter(id__in=batch).order_by().select_for_update().values_list('id', 'post_id', 'active')
+            )
+            # Nothing references a comment, so a plain DELETE is enough. QuerySet.delete()
+            # - would load every comment and send post_delete for each of them.
+            delete_rows(Comment, [pk for pk, _, _ in rows])
+            deltas = {}
+            for _, post_id, active in rows:
+                total, active_total = deltas.get(post_id, (0, 0))
+                deltas[post_id] = (total - 1, active_total - int(active))
+            counters.add_comments_many(deltas)
+            bump_sidebar()
+        deleted += len(rows)
+    return deleted
+
+
+####
+# Posts
+####
+
+# Publish (status='published') or unpublish (status='draft') the posts of a queryset.
+# - Returns the number of posts changed.
+def set_posts_status(queryset, status, batch_size=None):
+    changed = 0
+    for batch in id_batches(queryset.exclude(status=status), batch_size):
+        with transaction.atomic():
+            changed += _set_posts_status(batch, status)
+    return changed
+
+
+def _set_posts_status(batch, status):
+    posts = list(
+        Post.objects.filter(id__in=batch).exclude(status=status)
+        .order_by()
+        .select_for_update()
+        .defer('body_html', 'excerpt_html', 'search_vector')
+    )
+    if not posts:
+        return 0
+    ids = [post.pk for post in posts]
+    now = timezone.now()
+    # `updated` moves like it does on save(), for the feeds and sitemaps.
+    Post.objects.filter(id__in=ids).update(status=status, updated=now)
+
+    deltas = Counter({counters.status_key(status): len(posts)})
+    for post in posts:
+        deltas[counters.status_key(post.status)] -= 1
+        post.status, post.updated = status, now
+    tag_ids = {}
+    tagged = Post.tags.through.objects.filter(
+        content_type=ContentType.objects.get_for_model(Post), object_id__in=ids,
+    ).values_list('object_id', 'tag_id')
+    for post_id, tag_id in tagged:
+        tag_ids.setdefault(post_id, []).append(tag_id)
+        # Tag counters only count published posts.
+        deltas[counters.tag_key(tag_id)] += 1 if status == 'published' else -1
+    counters.apply_deltas(dict(deltas))
+
+    refresh_similar_posts_bulk(posts)
+    tag_index.update_posts(posts, tag_ids)
+    if bm25_index.enabled():
+        bm25_index.update_posts(posts)
+    autocomplete_index.update_posts(posts)
+    bump_sidebar()
+    bump_search()
+    bump_feed()
+    return len(posts)
@@ -0,0 +1,188 @@
+import logging
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX = {
+    'BATCH_SIZE': 50,
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 60,
+    'MAX_BACKOFF': 3600,
+    'LEASE': 300,
+}
+
+
+def outbox_settings():
+    return {**DEFAULT_OUTBOX, **getattr(settings, 'BLOG_OUTBOX', {})}
+
+
+# Queue an email; it's sent by the next run of the outbox workers. Takes the same
+# - arguments as send_mail().
+def enqueue(subject, message, from_email, recipient_list):
+    return OutboxMessage.objects.create(
+        subject=subject, body=message, from_email=from_email, recipients=','.join(recipient_list),
+    )
+
+
+# Delay before the next attempt of a message that failed `attempts` times: doubled
+# - at every failure up to MAX_BACKOFF, with some jitter so failed messages don't
+# - all come back at once.
+def backoff(attempts, options=None):
+    options = options or outbox_settings()
+    delay = min(options['BACKOFF'] * 2 ** (attempts - 1), options['MAX_BACKOFF'])
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+# Claim up to `batch_size` due messages for one worker. The UPDATE only takes the
+# - messages that are still due, so two workers never claim the same message: the
+# - first one moves next_attempt to the end of its lease. A message whose worker
+# - died is due again once the lease is over. Every claim counts as an attempt, so
+# - a message that keeps killing its worker is given up after MAX_ATTEMPTS claims.
+def claim(batch_size, options=None):
+    options = options or outbox_settings()
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = OutboxMessage.objects.filter(status__in=('queued', 'sending'), next_attempt__lte=now)
+    due.filter(status='sending', attempts__gte=options['MAX_ATTEMPTS']).update(
+        status='failed', claim='', last_error='The worker sending it stopped before it was sent.',
+    )
+    ids = list(due.order_by('next_attempt', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    due.filter(id__in=ids).update(
+        status='sending', claim=token, attempts=F('attempts') + 1,
+        next_attempt=now + timedelta(seconds=options['LEASE']),
+    )
+    return list(OutboxMessage.objects.filter(claim=token, status='sending').order_by('id'))
+
+
+# Move the end of a batch's lease LEASE seconds ahead, and return the ids of the
+# - messages the batch still holds: a message whose lease ran out may have been
+# - claimed by another worker since.
+def renew_lease(token, options):
+    held = OutboxMessage.objects.filter(claim=token, status='sending')
+    held.update(next_attempt=timezone.now() + timedelta(seconds=options['LEASE']))
+    return set(held.values_list('id', flat=True))
+
+
+# Send claimed messages over one open connection. A message that fails is put back
+# - in the queue with a backoff (or given up after MAX_ATTEMPTS) and the connection
+# - is opened again for the next one. The lease is renewed every LEASE / 2 seconds,
+# - so a slow batch keeps its messages; one that lost a message to another worker
+# - skips it. Returns the numbers of sent and failed messages.
+def send_batch(connection, messages, options=None):
+    options = options or outbox_settings()
+    sent, failed = [], []
+    token = messages[0].claim if messages else ''
+    renew_at = time.monotonic() + options['LEASE'] / 2
+    held = None
+    for position, message in enumerate(messages):
+        if time.monotonic() >= renew_at:
+            held = renew_lease(token, options)
+            renew_at = time.monotonic() + options['LEASE'] / 2
+        if held is not None and message.pk not in held:
+            continue
+        try:
+            email = EmailMessage(
+                message.subject, message.body, message.from_email, message.recipient_list, connection=connection,
+            )
+            if connection.send_messages([email]) != 1:
+                raise RuntimeError('The email backend did not send the message.')
+        except Exception as error:
+            logger.warning('Sending outbox message %s failed: %s', message.pk, error)
+            failed.append((message, error))
+            try:
+                connection.close()
+                connection.open()
+            except Exception as reopen_error:
+                # The server is gone: leave the rest of the batch for a later attempt.
+                failed.extend((remaining, reopen_error) for remaining in messages[position + 1:])
+                break
+        else:
+            sent.append(message.pk)
+
+    # One UPDATE for the whole batch; failures are rare and written one by one.
+    OutboxMessage.objects.filter(id__in=sent, claim=token).update(
+        status='sent', sent=timezone.now(), claim='', last_error='',
+    )
+    record_failures(failed, options)
+    return len(sent), len(failed)
+
+
+# Put failed messages back in the queue with a backoff, or give them up after
+# - MAX_ATTEMPTS attempts.
+def record_failures(failed, options):
+    now = timezone.now()
+    for message, error in failed:
+        # The attempt was counted when the message was claimed.
+        attempts = message.attempts
+        OutboxMessage.objects.filter(id=message.pk, claim=message.claim).update(
+            status='failed' if attempts >= options['MAX_ATTEMPTS'] else 'queued',
+            next_attempt=now + backoff(attempts, options),
+            claim='',
+            last_error=str(error)[:1000],
+        )
+
+
+# One worker: claim and send batches until no message is due, over a single
+# - connection opened once and reused for every batch.
+def drain(batch_size=None):
+    options = outbox_settings()
+    batch_size = batch_size or options['BATCH_SIZE']
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        while True:
+            messages = claim(batch_size, options)
+            if not messages:
+                break
+            try:
+                connection.open()
+            except Exception as error:
+                logger.warning('Opening the email connection failed: %s', error)
+                # Nothing of the batch can be sent: back off and stop this run.
+                record_failures([(message, error) for message in messages], options)
+                failed += len(messages)
+                break
+            batch_sent, batch_failed = send_batch(connection, messages, options)
+            sent += batch_sent
+            failed += batch_failed
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return sent, failed
+
+
+def _drain_in_thread(batch_size):
+    try:
+        return drain(batch_size)
+    finally:
+        # Every thread has its own database connection.
+        connections.close_all()
+
+
+# Drain the outbox with up to `workers` workers (WORKERS by default), which is also
+# - the most SMTP connections open at a time. Returns the numbers of sent and
+# - failed messages.
+def drain_outbox(workers=None, batch_size=None):
+    workers = workers or outbox_settings()['WORKERS']
+    if workers == 1:
+        return drain(batch_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_drain_in_thread, [batch_size] * workers))
+    return sum(sent for sent, _ in results), sum(failed for _, failed in results)
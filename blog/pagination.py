@@ -0,0 +1,261 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .counters import can_estimate, count_posts, estimated_count, tag_key
+
+
+# Raised when a cursor token can't be decoded back into a pagination key.
+class InvalidCursor(Exception):
+    pass
+
+
+# Encode the direction and the key values of an object into an opaque, URL safe
+# - token that is passed around as the ?cursor= GET parameter.
+def encode_cursor(direction, values):
+    raw = json.dumps([direction, *values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+# Turn a token built by encode_cursor() back into (direction, values).
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, *values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor(token)
+    return direction, values
+
+
+# A single page of a keyset paginated list. It behaves like a Django Page for
+# - iteration, but it has no page number: it only knows its neighbours and, when
+# - the paginator tracks it, how many objects come before it (start).
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous, start=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.start = start
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    # 1-based positions of the first and last objects of the page, when known.
+    def start_index(self):
+        return None if self.start is None else self.start + 1
+
+    def end_index(self):
+        return None if self.start is None else self.start + len(self.object_list)
+
+    # The cursor for the next page points at the last object shown on this one.
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        values = self.paginator.cursor_values(self.object_list[-1], self.end_index())
+        return encode_cursor('next', values)
+
+    # The cursor for the previous page points at the first object shown on this one.
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor('prev', self.paginator.cursor_values(self.object_list[0], self.start))
+
+
+# Cursor based (seek) paginator for lists ordered newest first by (publish, id).
+# - Instead of OFFSET n LIMIT k plus a COUNT(*), every page is a single
+# - "WHERE (publish, id) < (cursor) ORDER BY publish DESC, id DESC LIMIT k + 1"
+# - query, so page 1000 costs the same as page 1. Subclasses can page on another
+# - key by overriding cursor_values(), parse_cursor_values(), older() and newer().
+class KeysetPaginator:
+    # Lets templates tell a keyset paginator apart from django.core.paginator.Paginator.
+    keyset = True
+
+    # max_results caps how far the list can be paged, for keys that track positions.
+    def __init__(self, object_list, per_page, max_results=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.max_results = max_results
+
+    # The JSON values a cursor stores for an object at the given position.
+    def cursor_values(self, obj, position):
+        return [obj.publish.isoformat(), obj.pk]
+
+    # Turn cursor values back into (key, position). The position is None when
+    # - the cursor doesn't track it.
+    def parse_cursor_values(self, values):
+        try:
+            publish, pk = values
+            publish = parse_datetime(publish)
+        except (ValueError, TypeError):
+            raise InvalidCursor(values)
+        if publish is None or not isinstance(pk, int):
+            raise InvalidCursor(values)
+        return (publish, pk), None
+
+    # Return the page that follows (or precedes) the given cursor, or the
+    # - first page when no cursor is given. Raises InvalidCursor for bad tokens.
+    def page(self, cursor=None):
+        if not cursor:
+            return self._page_after(None, has_previous=False, start=0)
+        direction, values = decode_cursor(cursor)
+        key, position = self.parse_cursor_values(values)
+        if direction == 'next':
+            return self._page_after(key, has_previous=True, start=position)
+        return self._page_before(key, end=position)
+
+    # Up to `limit` posts older than the (publish, id) key (all posts without a key),
+    # - newest first.
+    def older(self, key, limit):
+        queryset = self.object_list
+        if key is not None:
+            publish, pk = key
+            queryset = queryset.filter(Q(publish__lt=publish) | Q(publish=publish, pk__lt=pk))
+        return list(queryset.order_by('-publish', '-pk')[:limit])
+
+    # Up to `limit` posts newer than the key, oldest first, so the LIMIT keeps
+    # - the rows right next to the key.
+    def newer(self, key, limit):
+        publish, pk = key
+        queryset = self.object_list.filter(Q(publish__gt=publish) | Q(publish=publish, pk__gt=pk))
+        return list(queryset.order_by('publish', 'pk')[:limit])
+
+    # How many objects a page starting at `start` may hold under max_results.
+    def _room(self, start):
+        if self.max_results is None or start is None:
+            return self.per_page
+        return max(min(self.per_page, self.max_results - start), 0)
+
+    def _page_after(self, key, has_previous, start):
+        room = self._room(start)
+        if not room:
+            return KeysetPage([], self, False, has_previous, start)
+        # Fetch one extra row to find out whether there is a next page, unless
+        # - this page already reaches max_results.
+        rows = self.older(key, room + 1)
+        has_next = len(rows) > room and self._room(start + room if start is not None else None) > 0
+        return KeysetPage(rows[:room], self, has_next, has_previous, start)
+
+    # Newer rows come oldest first and are flipped back to newest first.
+    def _page_before(self, key, end):
+        rows = self.newer(key, self.per_page + 1)
+        if not rows:
+            # Nothing newer than the key anymore, so this is the first page.
+            return self._page_after(None, has_previous=False, start=0)
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        start = None if end is None else max(end - len(rows), 0)
+        return KeysetPage(rows, self, True, has_previous, start)
+
+
+# Fetch posts by id from a queryset, keeping the order of the ids.
+def _posts_by_id(queryset, ids):
+    posts = {post.pk: post for post in queryset.filter(pk__in=ids)}
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+# Keyset paginator for the posts of one tag. While the in-memory tag index is
+# - warm, it picks the ids of a page without touching the tagged item table and
+# - `posts` only has to fetch those rows by primary key.
+class TagIndexPaginator(KeysetPaginator):
+    def __init__(self, object_list, per_page, tag_id, index, posts):
+        super().__init__(object_list, per_page)
+        self.tag_id = tag_id
+        self.index = index
+        self.posts = posts
+
+    def older(self, key, limit):
+        ids = self.index.tag_slice(self.tag_id, limit, before=key)
+        if ids is None:
+            return super().older(key, limit)
+        return _posts_by_id(self.posts, ids)
+
+    def newer(self, key, limit):
+        ids = self.index.tag_slice(self.tag_id, limit, after=key)
+        if ids is None:
+            return super().newer(key, limit)
+        return _posts_by_id(self.posts, ids)
+
+
+# The published posts of one tag as a lazy sequence for the numbered Paginator.
+# - Slices are answered by the tag index when it's warm, and by the tag filtered
+# - queryset otherwise.
+class TagIndexPostList:
+    def __init__(self, object_list, tag_id, index, posts):
+        self.object_list = object_list
+        self.tag_id = tag_id
+        self.index = index
+        self.posts = posts
+        self.ordered = True
+
+    def count(self):
+        count = self.index.tag_count(self.tag_id)
+        if count is None:
+            return count_posts(self.object_list, tag_key(self.tag_id))
+        return count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        ids = self.index.tag_range(self.tag_id, index.start or 0, index.stop)
+        if ids is None:
+            return self.object_list[index]
+        return _posts_by_id(self.posts, ids)
+
+
+# Numbered paginator that takes its total from the post counters instead of
+# - running SELECT COUNT(*) over the (possibly joined) queryset on every page.
+class CountedPaginator(Paginator):
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        return count_posts(self.object_list, self.count_key)
+
+
+# Numbered paginator for the admin changelists of big tables. Results the PostgreSQL
+# - planner estimates at BLOG_ESTIMATED_COUNT_THRESHOLD rows or more are counted
+# - with the estimate instead of a COUNT(*) over every matching row. Other databases
+# - count exactly, once.
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if can_estimate(self.object_list):
+            estimate = estimated_count(self.object_list)
+            if estimate >= getattr(settings, 'BLOG_ESTIMATED_COUNT_THRESHOLD', 100000):
+                return estimate
+        return super().count
@@ -0,0 +1,88 @@
+import hashlib
+import json
+
+import markdown
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template.defaultfilters import truncatewords_html
+
+from .cache import LRUCache
+
+DEFAULT_MARKDOWN_CACHE = {
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 16 * 1024 * 1024,
+    'SHARED_CACHE': None,
+    'TIMEOUT': 3600,
+}
+
+_markdown_cache = None
+
+
+# Markdown extensions used to render post bodies, e.g. ['extra', 'toc'].
+def markdown_extensions():
+    return list(getattr(settings, 'BLOG_MARKDOWN_EXTENSIONS', []))
+
+
+# Fingerprint of the markdown renderer (library version and extensions). It is
+# - stored with every rendered post; a post whose signature doesn't match the
+# - current one was rendered by an older setup and has to be rendered again.
+def render_signature():
+    raw = json.dumps([markdown.__version__, markdown_extensions()])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+# Convert markdown .md syntax to HTML.
+def render_markdown(text):
+    return markdown.markdown(text, extensions=markdown_extensions())
+
+
+# Cut rendered HTML down to the excerpt shown on the post list.
+def render_excerpt(html):
+    return truncatewords_html(html, getattr(settings, 'BLOG_EXCERPT_WORDS', 30))
+
+
+def markdown_cache_settings():
+    return {**DEFAULT_MARKDOWN_CACHE, **getattr(settings, 'BLOG_MARKDOWN_CACHE', {})}
+
+
+# The per process cache of rendered markdown, built from BLOG_MARKDOWN_CACHE.
+def markdown_cache():
+    global _markdown_cache
+    if _markdown_cache is None:
+        options = markdown_cache_settings()
+        _markdown_cache = LRUCache(options['MAX_ENTRIES'], options['MAX_BYTES'])
+    return _markdown_cache
+
+
+@receiver(setting_changed)
+def reset_markdown_cache(setting, **kwargs):
+    global _markdown_cache
+    if setting in ('BLOG_MARKDOWN_CACHE', 'BLOG_MARKDOWN_EXTENSIONS'):
+        _markdown_cache = None
+
+
+# Like render_markdown(), but memoized by a hash of the text and the render
+# - signature. Lookups go to the process LRU first, then to the shared Django
+# - cache (if BLOG_MARKDOWN_CACHE['SHARED_CACHE'] names one), and only then
+# - the text is rendered, so a hot post is rendered once per worker at most.
+def render_markdown_cached(text):
+    signature = render_signature()
+    key = hashlib.sha1(f'{signature}:{text}'.encode()).hexdigest()
+    local = markdown_cache()
+    html = local.get(key)
+    if html is not None:
+        return html
+
+    options = markdown_cache_settings()
+    shared = caches[options['SHARED_CACHE']] if options['SHARED_CACHE'] else None
+    shared_key = f'blog:markdown:{key}'
+    if shared is not None:
+        html = shared.get(shared_key)
+    if html is None:
+        html = render_markdown(text)
+        if shared is not None:
+            shared.set(shared_key, html, options['TIMEOUT'])
+    local.set(key, html)
+    return html
@@ -0,0 +1,8 @@
+# Post search. The ranking itself is done by a pluggable backend (blog.search.base),
+# - PostgreSQL full-text search or the built-in BM25 engine; blog.search.results caches
+# - and pages the ranked hits the same way for both.
+from .base import SearchBackend, get_backend
+from .results import (
+    SearchPaginator, add_snippets, fuzzy_search_hits, max_search_results, search_hits, suggest_query,
+)
+from .facets import search_facets
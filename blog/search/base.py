@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .highlight import body_heads, highlight, render_snippet, snippet_settings
+
+_backend = None
+
+
+# Narrow published posts down to a tag (slug) and/or a publish year (in the current time
+# - zone). publish__year is turned into an indexable range, not an EXTRACT().
+def filter_posts(queryset, tag=None, year=None):
+    if tag is not None:
+        queryset = queryset.filter(tags__slug=tag)
+    if year is not None:
+        queryset = queryset.filter(publish__year=year)
+    return queryset
+
+
+# Interface of the search backends. A backend ranks the published posts for a query
+# - and returns the best ones as (post id, rank) pairs, best first; the view pages
+# - through them and loads the posts itself, so every backend yields the same results.
+# - The tag and year filters of the facets are applied by the backend before the
+# - results are capped, so a filter finds posts ranked below the cap too.
+class SearchBackend:
+    # Whether results can be cached under the current search generation. A backend
+    # - answering from a stale index says no, so stale results aren't kept.
+    def is_current(self):
+        return True
+
+    # Up to `limit` (post id, rank) pairs for a full-text query, best first.
+    def search(self, query, limit, tag=None, year=None):
+        raise NotImplementedError
+
+    # Up to `limit` (post id, rank) pairs of posts that look like the query, used
+    # - when full-text search finds nothing.
+    def fuzzy_search(self, query, limit, tag=None, year=None):
+        return []
+
+    # Queryset of every published post matching the query (or looking like it, with
+    # - fuzzy=True), unranked and uncapped. The facets are counted over it.
+    def matching_posts(self, query, fuzzy=False):
+        raise NotImplementedError
+
+    # A corrected query ("did you mean"), or None.
+    def suggest(self, query):
+        return None
+
+    # Highlighted snippets of the posts (ids) shown on a result page, as {id: safe HTML}.
+    # - Only the head of every body is read (BLOG_SEARCH_SNIPPETS['MAX_CHARS']).
+    def snippets(self, query, pks):
+        max_words = snippet_settings()['MAX_WORDS']
+        return {
+            pk: render_snippet(highlight(head, query, max_words))
+            for pk, head in body_heads(pks).items()
+        }
+
+
+# The search backend configured by BLOG_SEARCH_BACKEND (a dotted path), or by default
+# - the PostgreSQL backend on PostgreSQL and the built-in BM25 engine elsewhere.
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'BLOG_SEARCH_BACKEND', None)
+        if path is None:
+            if connection.vendor == 'postgresql':
+                path = 'blog.search.postgres.PostgresBackend'
+            else:
+                path = 'blog.search.bm25.BM25Backend'
+        _backend = import_string(path)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'BLOG_SEARCH_BACKEND':
+        _backend = None
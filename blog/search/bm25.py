@@ -0,0 +1,235 @@
+import difflib
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.db import transaction
+
+from ..indexing import InMemoryIndex
+from ..models import Post
+from ..text import STOP_WORDS, terms, words
+from .base import SearchBackend, filter_posts, get_backend
+
+GENERATION = 'search_index'
+
+
+# The terms of a post with their frequencies. Title terms count TITLE_WEIGHT times,
+# - like the A weight of the title in the PostgreSQL search vector.
+TITLE_WEIGHT = 2
+
+
+def document_terms(title, body):
+    counts = Counter(terms(body))
+    for term in terms(title):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+
+# In-process inverted index of the published posts, ranked with Okapi BM25. Every
+# - term has a posting list of two compact arrays (post ids, sorted, and the term
+# - frequencies in those posts). It also counts the (unstemmed) words of the posts
+# - for "did you mean" suggestions. It's built and kept up to date like every
+# - InMemoryIndex.
+class BM25Index(InMemoryIndex):
+    generation_name = GENERATION
+    label = 'search index'
+
+    # BM25 parameters: term frequency saturation and document length normalization.
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_words = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._words = Counter()
+
+    ####
+    # Building
+    ####
+
+    def enabled(self):
+        return isinstance(get_backend(), BM25Backend)
+
+    def load(self):
+        documents = {}
+        for pk, title, body in Post.published.values_list('id', 'title', 'body').iterator():
+            documents[pk] = (document_terms(title, body), set(words(f'{title} {body}')))
+        return documents
+
+    def install(self, documents):
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_words = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._words = Counter()
+        unsorted = {}
+        for pk in sorted(documents):
+            counts, doc_words = documents[pk]
+            for term, frequency in counts.items():
+                unsorted.setdefault(term, []).append((pk, frequency))
+            self._add_document(pk, counts, doc_words)
+        for term, postings in unsorted.items():
+            self._postings[term] = (array('q', (p[0] for p in postings)), array('I', (p[1] for p in postings)))
+
+    def describe(self):
+        return f'{len(self._lengths)} posts and {len(self._postings)} terms'
+
+    ####
+    # Updates
+    ####
+
+    # Index the current title and body of a post, or drop it when it isn't published.
+    # - Applied once the transaction commits.
+    def update_post(self, post):
+        change = self._post_change(post)
+        transaction.on_commit(lambda: self.update(*change))
+
+    def update_posts(self, posts):
+        changes = [self._post_change(post) for post in posts]
+        transaction.on_commit(lambda: self.update_many(changes))
+
+    @staticmethod
+    def _post_change(post):
+        if post.status != 'published':
+            return post.pk, None, None
+        return post.pk, document_terms(post.title, post.body), set(words(f'{post.title} {post.body}'))
+
+    def remove_post(self, pk):
+        transaction.on_commit(lambda: self.update(pk, None, None))
+
+    def apply(self, pk, counts, doc_words):
+        for term in self._doc_terms.pop(pk, ()):
+            ids, frequencies = self._postings[term]
+            position = bisect_left(ids, pk)
+            del ids[position]
+            del frequencies[position]
+            if not ids:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(pk, 0)
+        self._words.subtract(self._doc_words.pop(pk, ()))
+        if counts is None:
+            return
+        for term, frequency in counts.items():
+            ids, frequencies = self._postings.setdefault(term, (array('q'), array('I')))
+            position = bisect_left(ids, pk)
+            ids.insert(position, pk)
+            frequencies.insert(position, frequency)
+        self._add_document(pk, counts, doc_words)
+
+    def _add_document(self, pk, counts, doc_words):
+        self._doc_terms[pk] = tuple(counts)
+        self._doc_words[pk] = tuple(doc_words)
+        self._lengths[pk] = sum(counts.values())
+        self._total_length += self._lengths[pk]
+        self._words.update(doc_words)
+
+    ####
+    # Queries
+    ####
+
+    # The BM25 score of every post matching the terms of a query, as {id: score}.
+    # - A post matching any term is a hit; posts matching more (and rarer) terms
+    # - score higher. With `candidates` (a set of ids), only those posts are scored.
+    def scores(self, query, candidates=None):
+        scores = Counter()
+        with self._lock:
+            count = len(self._lengths)
+            if not count:
+                return scores
+            average_length = self._total_length / count
+            for term in set(terms(query)):
+                ids, frequencies = self._postings.get(term, ((), ()))
+                if not ids:
+                    continue
+                idf = math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+                for pk, frequency in zip(ids, frequencies):
+                    if candidates is not None and pk not in candidates:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[pk] / average_length)
+                    scores[pk] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    # Up to `limit` (post id, score) pairs for the terms of a query, best first.
+    def search(self, query, limit, candidates=None):
+        scores = self.scores(query, candidates)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+
+    # Replace every word of the query the posts don't use by the closest word they
+    # - do use (the most common one on ties). None when there is nothing to suggest.
+    def suggest(self, query):
+        query_words = words(query)
+        suggestion = []
+        with self._lock:
+            for word in query_words:
+                if not self._words.get(word) and len(word) > 2 and word not in STOP_WORDS:
+                    candidates = [
+                        candidate for candidate, documents in self._words.items()
+                        if documents > 0 and abs(len(candidate) - len(word)) <= 2
+                    ]
+                    matches = difflib.get_close_matches(word, candidates, n=3, cutoff=0.75)
+                    if matches:
+                        word = max(matches, key=lambda match: (
+                            difflib.SequenceMatcher(None, word, match).ratio(), self._words[match],
+                        ))
+                suggestion.append(word)
+        suggestion = ' '.join(suggestion)
+        return suggestion if suggestion != ' '.join(query_words) else None
+
+
+bm25_index = BM25Index()
+
+
+# Search with the built-in BM25 index, for databases without full-text search
+# - (SQLite in CI, local load testing and read-only replicas). The index is built
+# - in the background on the first request, or by the first search if that comes
+# - sooner. Misspelled queries are searched again with the suggested correction.
+class BM25Backend(SearchBackend):
+    def __init__(self, index=None):
+        self.index = index or bm25_index
+
+    # A stale index still answers (unpublished posts are dropped when the page
+    # - is loaded), but its results aren't cached.
+    def is_current(self):
+        return self.index.warm
+
+    def _ensure_built(self):
+        if not self.index.built:
+            self.index.rebuild()
+
+    # The tag and year filters are looked up in the database and only the posts they
+    # - let through are scored.
+    def search(self, query, limit, tag=None, year=None):
+        self._ensure_built()
+        candidates = None
+        if tag is not None or year is not None:
+            candidates = set(filter_posts(Post.published, tag, year).values_list('pk', flat=True))
+        return self.index.search(query, limit, candidates)
+
+    def fuzzy_search(self, query, limit, tag=None, year=None):
+        suggestion = self.suggest(query)
+        return self.search(suggestion, limit, tag, year) if suggestion else []
+
+    def matching_posts(self, query, fuzzy=False):
+        if fuzzy:
+            query = self.suggest(query)
+            if not query:
+                return Post.published.none()
+        self._ensure_built()
+        return Post.published.filter(pk__in=list(self.index.scores(query)))
+
+    def suggest(self, query):
+        self._ensure_built()
+        return self.index.suggest(query)
+
+
+# Build the index the first time the process serves a request, when it's the search backend.
+def warm_search_index(**kwargs):
+    if bm25_index.enabled() and not bm25_index.built:
+        bm25_index.rebuild_in_background()
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+from taggit.models import Tag
+
+from ..models import Post
+from ..text import normalize_query, words
+from .base import filter_posts, get_backend
+from .results import cached
+
+
+# Count the tags and publish years (in the current time zone) of every published post
+# - of `posts` that passes the tag (slug) and year filters: {'tags': [{'name', 'slug',
+# - 'count'}], 'years': [{'year', 'count'}]}. Each facet is one grouped query over the
+# - whole match set, however many posts it holds. The most common
+# - BLOG_SEARCH_FACET_TAGS tags are listed (oldest tag first on ties), and years
+# - newest first.
+def compute_facets(posts, tag=None, year=None):
+    matches = filter_posts(posts, tag, year).values('pk')
+    tags = Tag.objects.filter(
+        taggit_taggeditem_items__content_type=ContentType.objects.get_for_model(Post),
+        taggit_taggeditem_items__object_id__in=matches,
+    ).annotate(
+        count=Count('taggit_taggeditem_items'),
+    ).order_by('-count', 'id').values_list('name', 'slug', 'count')
+    years = Post.published.filter(pk__in=matches).annotate(
+        year=ExtractYear('publish'),
+    ).order_by().values('year').annotate(count=Count('pk')).order_by('-year').values_list('year', 'count')
+    return {
+        'tags': [
+            {'name': name, 'slug': slug, 'count': count}
+            for name, slug, count in tags[:getattr(settings, 'BLOG_SEARCH_FACET_TAGS', 10)]
+        ],
+        'years': [{'year': post_year, 'count': count} for post_year, count in years],
+    }
+
+
+# compute_facets() for the matches of a query, cached by the query (normalized like
+# - the hits) and the filters. Unlike the hits, the facets cover every match.
+def search_facets(query, tag=None, year=None, fuzzy=False):
+    if fuzzy:
+        query = ' '.join(words(query))
+        key = ('facets', 'fuzzy', query, tag, year)
+    else:
+        key = ('facets', 'text', normalize_query(query), tag, year)
+    return cached(key, lambda: compute_facets(get_backend().matching_posts(query, fuzzy), tag, year))
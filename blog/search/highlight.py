@@ -0,0 +1,78 @@
+import re
+
+from django.conf import settings
+from django.db.models.functions import Substr
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from ..models import Post
+from ..text import STOP_WORDS, stem
+
+DEFAULT_SEARCH_SNIPPETS = {
+    # Characters of a post body read to build its snippet.
+    'MAX_CHARS': 5000,
+    # Words shown around the matches.
+    'MAX_WORDS': 30,
+}
+
+# Markers around the matched words in a raw snippet.
+START_MARK = '⟦'
+STOP_MARK = '⟧'
+
+_MARKED = re.compile(f'{START_MARK}(.*?){STOP_MARK}', re.S)
+# Markdown markup left out of snippets: link and image brackets and targets, emphasis,
+# - code, heading and quote markers.
+_MARKDOWN = re.compile(r'\]\([^)\s]*\)|!?\[|\]|[*`#>]+|(?<!\w)_+|_+(?!\w)')
+_WORD = re.compile(r'\w+')
+
+
+def snippet_settings():
+    return {**DEFAULT_SEARCH_SNIPPETS, **getattr(settings, 'BLOG_SEARCH_SNIPPETS', {})}
+
+
+# The first MAX_CHARS characters of the bodies of some posts, by id. Only this
+# - much of a body is ever read, however long the post is.
+def body_heads(pks):
+    return dict(
+        Post.objects.filter(pk__in=pks).annotate(
+            head=Substr('body', 1, snippet_settings()['MAX_CHARS']),
+        ).values_list('pk', 'head')
+    )
+
+
+# Turn raw snippet text, with the matches between START_MARK and STOP_MARK, into safe
+# - HTML: markdown markup dropped, text escaped and the matches wrapped in <mark>.
+def render_snippet(text):
+    parts = _MARKED.split(_MARKDOWN.sub('', text))
+    html = ''.join(f'<mark>{escape(part)}</mark>' if i % 2 else escape(part) for i, part in enumerate(parts))
+    return mark_safe(' '.join(html.split()))
+
+
+# Mark the words of a text that match the terms of the query, and cut it down to
+# - about `max_words` words around the first match (the start of the text when
+# - nothing matches). The Python counterpart of ts_headline().
+def highlight(text, query, max_words):
+    query_terms = {stem(word) for word in _WORD.findall(query.casefold()) if word not in STOP_WORDS}
+    tokens = list(_WORD.finditer(text))
+    if not tokens:
+        return ''
+    matches = [i for i, token in enumerate(tokens) if stem(token.group().casefold()) in query_terms]
+    first = max(matches[0] - max_words // 3, 0) if matches else 0
+    last = min(first + max_words, len(tokens)) - 1
+    marked = set(matches)
+    pieces = []
+    position = tokens[first].start()
+    for i in range(first, last + 1):
+        token = tokens[i]
+        pieces.append(text[position:token.start()])
+        if i in marked:
+            pieces.append(f'{START_MARK}{token.group()}{STOP_MARK}')
+        else:
+            pieces.append(token.group())
+        position = token.end()
+    if last < len(tokens) - 1:
+        pieces.append(' ...')
+    else:
+        pieces.append(text[position:])
+    snippet = ''.join(pieces)
+    return '... ' + snippet if first > 0 else snippet
@@ -0,0 +1,96 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Func, Q, TextField, Value
+from django.db.models.functions import Substr
+
+from ..models import Post, SearchTerm
+from ..text import words
+from .base import SearchBackend, filter_posts
+from .highlight import START_MARK, STOP_MARK, render_snippet, snippet_settings
+
+
+# ts_headline(document, query, options): the fragments of the document around the
+# - matches of the query, with the matched words marked.
+class Headline(Func):
+    function = 'ts_headline'
+    output_field = TextField()
+
+    def __init__(self, expression, query, options):
+        super().__init__(expression, query, Value(options))
+
+
+# Published posts matching a full-text query, most relevant first. The query is matched
+# - with @@ against the stored, GIN indexed Post.search_vector, so only matching posts
+# - are ranked instead of building a vector for every post at query time.
+def search_posts(query):
+    search_query = SearchQuery(query)
+    return Post.published.filter(
+        search_vector=search_query,
+    ).annotate(
+        rank=SearchRank(F('search_vector'), search_query),
+        # Filter the results to display only the ones with a rank higher than 0.3.
+    ).filter(rank__gte=0.3).order_by('-rank', '-pk')
+
+
+# Published posts whose title, or one of whose tags, looks like the query, most similar
+# - title first. Used when full-text search finds nothing, so typos still find posts.
+# - The % operator (trigram_similar) is answered by the pg_trgm GIN indexes on the title
+# - and tag names; the similarity is only computed for the rows it lets through.
+def fuzzy_search_posts(query):
+    tagged = Post.published.filter(tags__name__trigram_similar=query).values('pk')
+    return Post.published.filter(
+        Q(title__trigram_similar=query) | Q(pk__in=tagged),
+    ).annotate(
+        rank=TrigramSimilarity('title', query),
+    ).order_by('-rank', '-pk')
+
+
+# Replace every word of the query that isn't in the vocabulary by the most similar
+# - word that is (the most common one on ties). Returns None when there is nothing
+# - to suggest.
+def suggest_query(query):
+    query_words = words(query)
+    known = set(SearchTerm.objects.filter(word__in=query_words).values_list('word', flat=True))
+    suggestion = []
+    for word in query_words:
+        if word not in known and len(word) > 2:
+            word = SearchTerm.objects.filter(
+                word__trigram_similar=word,
+            ).annotate(
+                similarity=TrigramSimilarity('word', word),
+            ).order_by('-similarity', '-documents').values_list('word', flat=True).first() or word
+        suggestion.append(word)
+    suggestion = ' '.join(suggestion)
+    return suggestion if suggestion != ' '.join(query_words) else None
+
+
+# Full-text search with PostgreSQL: ts_rank over the stored search vectors, trigram
+# - similarity for the fuzzy fallback and the SearchTerm vocabulary for suggestions.
+class PostgresBackend(SearchBackend):
+    def search(self, query, limit, tag=None, year=None):
+        return list(filter_posts(search_posts(query), tag, year).values_list('pk', 'rank')[:limit])
+
+    def fuzzy_search(self, query, limit, tag=None, year=None):
+        return list(filter_posts(fuzzy_search_posts(query), tag, year).values_list('pk', 'rank')[:limit])
+
+    def matching_posts(self, query, fuzzy=False):
+        return fuzzy_search_posts(query) if fuzzy else search_posts(query)
+
+    def suggest(self, query):
+        return suggest_query(query)
+
+    # ts_headline() only runs over the head of the bodies of the page shown.
+    def snippets(self, query, pks):
+        options = snippet_settings()
+        max_words = options['MAX_WORDS']
+        headline = Headline(
+            Substr('body', 1, options['MAX_CHARS']),
+            SearchQuery(query),
+            f'StartSel={START_MARK}, StopSel={STOP_MARK}, MaxWords={max_words}, '
+            f'MinWords={max_words // 2}, MaxFragments=2, FragmentDelimiter=" ... "',
+        )
+        return {
+            pk: render_snippet(snippet)
+            for pk, snippet in Post.objects.filter(pk__in=pks).annotate(
+                snippet=headline,
+            ).values_list('pk', 'snippet')
+        }
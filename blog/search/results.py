@@ -0,0 +1,140 @@
+import bisect
+import logging
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from ..cache import SEARCH_GENERATION, LRUCache, get_generation
+from ..pagination import InvalidCursor, KeysetPaginator, _posts_by_id
+from ..text import normalize_query, words
+from .base import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of results a search can be paged through.
+def max_search_results():
+    return getattr(settings, 'BLOG_SEARCH_MAX_RESULTS', 200)
+
+
+# Paginator over the ranked hits of a search, ordered by (rank, id) descending.
+# - The cursor also stores the position of the result, so the list is capped at
+# - max_results without counting the matches. Only the posts of the page shown
+# - are fetched, by primary key, from `posts`.
+class SearchPaginator(KeysetPaginator):
+    def __init__(self, hits, per_page, posts, max_results=None):
+        super().__init__(hits, per_page, max_results)
+        self.posts = posts
+        # Ascending sort keys of the hits, for bisecting.
+        self._keys = [(-rank, -pk) for pk, rank in hits]
+
+    def cursor_values(self, obj, position):
+        return [obj.rank, obj.pk, position]
+
+    def parse_cursor_values(self, values):
+        try:
+            rank, pk, position = values
+        except (ValueError, TypeError):
+            raise InvalidCursor(values)
+        if not isinstance(rank, (int, float)) or not isinstance(pk, int) or not isinstance(position, int):
+            raise InvalidCursor(values)
+        return (float(rank), pk), max(position, 0)
+
+    def _fetch(self, hits):
+        ranks = dict(hits)
+        posts = _posts_by_id(self.posts, list(ranks))
+        for post in posts:
+            post.rank = ranks[post.pk]
+        return posts
+
+    def older(self, key, limit):
+        start = 0 if key is None else bisect.bisect_right(self._keys, (-key[0], -key[1]))
+        return self._fetch(self.object_list[start:start + limit])
+
+    def newer(self, key, limit):
+        end = bisect.bisect_left(self._keys, (-key[0], -key[1]))
+        return self._fetch(self.object_list[max(end - limit, 0):end][::-1])
+
+
+####
+# Result cache
+####
+
+# A few hundred queries make up most of the searches, so their ranked hits are kept
+# - in a per process LRU keyed by the case folded query and the search generation,
+# - which is bumped whenever a published post changes (see blog/signals.py).
+DEFAULT_SEARCH_CACHE = {
+    'MAX_ENTRIES': 1000,
+    # Log the hit rate every this many lookups (0 to never log it).
+    'STATS_EVERY': 1000,
+}
+
+_result_cache = None
+
+
+def search_cache_settings():
+    return {**DEFAULT_SEARCH_CACHE, **getattr(settings, 'BLOG_SEARCH_CACHE', {})}
+
+
+def result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = LRUCache(search_cache_settings()['MAX_ENTRIES'])
+    return _result_cache
+
+
+@receiver(setting_changed)
+def reset_result_cache(setting, **kwargs):
+    global _result_cache
+    if setting in ('BLOG_SEARCH_CACHE', 'BLOG_SEARCH_MAX_RESULTS', 'BLOG_SEARCH_BACKEND'):
+        _result_cache = None
+
+
+# Cached result of compute() for a key, under the current search generation.
+def cached(key, compute):
+    if not get_backend().is_current():
+        return compute()
+    cache = result_cache()
+    hits = cache.get_or_set((get_generation(SEARCH_GENERATION), *key), compute)
+    every = search_cache_settings()['STATS_EVERY']
+    if every and (cache.hits + cache.misses) % every == 0:
+        stats = cache.stats()
+        logger.info(
+            'Search result cache: %.1f%% hit rate (%d hits, %d misses, %d entries, %d evictions)',
+            stats['hit_rate'] * 100, stats['hits'], stats['misses'], stats['entries'], stats['evictions'],
+        )
+    return hits
+
+
+# The best matches of a full-text search as (post id, rank) pairs, best first: up to
+# - max_search_results() of them plus one, which tells that there are more. The tag
+# - (slug) and year filters are applied before the cap. Queries differing only in
+# - case or spacing (see blog.text.normalize_query) share one cache entry; the
+# - backend is given the query as typed.
+def search_hits(query, tag=None, year=None):
+    return cached(
+        ('text', normalize_query(query), tag, year),
+        lambda: get_backend().search(query, max_search_results() + 1, tag, year),
+    )
+
+
+# Like search_hits(), for the fuzzy search of the backend, cached by the case folded query.
+def fuzzy_search_hits(query, tag=None, year=None):
+    query = ' '.join(words(query))
+    return cached(
+        ('fuzzy', query, tag, year),
+        lambda: get_backend().fuzzy_search(query, max_search_results() + 1, tag, year),
+    )
+
+
+def suggest_query(query):
+    return get_backend().suggest(query)
+
+
+# Attach highlighted snippets (post.snippet) to the posts of a result page. Only
+# - the posts shown are highlighted, so the cost doesn't grow with the matches.
+def add_snippets(posts, query):
+    snippets = get_backend().snippets(query, [post.pk for post in posts])
+    for post in posts:
+        post.snippet = snippets.get(post.pk, '')
@@ -0,0 +1,47 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from ..models import Post, SearchTerm
+from ..text import words
+
+
+# Number of published posts using every word of the titles, bodies and tag names.
+# - PostgreSQL lists the words with ts_stat() over unstemmed ('simple') vectors;
+# - other databases split the texts in Python.
+def vocabulary():
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT word, ndoc FROM ts_stat($$
+                    SELECT to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(body, ''))
+                    FROM blog_post WHERE status = 'published'
+                $$)
+            """)
+            counts = Counter(dict(cursor.fetchall()))
+    else:
+        counts = Counter()
+        for title, body in Post.published.values_list('title', 'body').iterator():
+            counts.update(set(words(f'{title} {body}')))
+    tag_counts = Post.published.filter(
+        tags__isnull=False,
+    ).values_list('tags__name').annotate(documents=Count('pk')).order_by()
+    for name, documents in tag_counts:
+        for word in set(words(name)):
+            counts[word] = max(counts[word], documents)
+    return counts
+
+
+# Replace the stored vocabulary (used by the PostgreSQL backend's "did you mean"
+# - suggestions) by the current one.
+@transaction.atomic
+def build_vocabulary(batch_size=1000):
+    terms = [
+        SearchTerm(word=word, documents=documents)
+        for word, documents in vocabulary().items()
+        if len(word) <= 100
+    ]
+    SearchTerm.objects.all().delete()
+    SearchTerm.objects.bulk_create(terms, batch_size=batch_size)
+    return len(terms)
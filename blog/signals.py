@@ -0,0 +1,340 @@
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from taggit.models import Tag
+
+from . import counters
+from .autocomplete import autocomplete_index, warm_autocomplete_index
+from .cache import FEED_GENERATION, SEARCH_GENERATION, SIDEBAR_GENERATION, bump_generation
+from .models import Comment, Post
+from .search.bm25 import bm25_index, warm_search_index
+from .similarity import posts_listing, rebuild_similar_posts, refresh_similar_posts
+from .tag_index import tag_index, warm_tag_index
+
+
+# Invalidate the cached sidebar once the change is committed.
+def bump_sidebar():
+    transaction.on_commit(lambda: bump_generation(SIDEBAR_GENERATION))
+
+
+# Invalidate the cached search results once the change is committed.
+def bump_search():
+    transaction.on_commit(lambda: bump_generation(SEARCH_GENERATION))
+
+
+# Invalidate the cached feeds once the change is committed.
+def bump_feed():
+    transaction.on_commit(lambda: bump_generation(FEED_GENERATION))
+
+
+####
+# Post signals
+####
+
+# Remember what the post looked like in the database before this save, so the
+# - post_save handlers can tell a publish or unpublish apart from an edit.
+@receiver(pre_save, sender=Post)
+def remember_previous_state(sender, instance, raw, **kwargs):
+    instance._previous_status = instance._previous_publish = None
+    instance._previous_title = instance._previous_slug = None
+    if instance.pk and not raw:
+        previous = Post.objects.filter(pk=instance.pk).values_list('status', 'publish', 'title', 'slug').first()
+        if previous:
+            (instance._previous_status, instance._previous_publish,
+             instance._previous_title, instance._previous_slug) = previous
+
+
+@receiver(post_save, sender=Post)
+def update_post_counters(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = instance._previous_status
+    if previous == instance.status:
+        return
+    deltas = {counters.status_key(instance.status): 1}
+    if previous:
+        deltas[counters.status_key(previous)] = -1
+    # A new post has no tags yet; its tags are counted when they are added.
+    if not created and 'published' in (previous, instance.status):
+        delta = 1 if instance.status == 'published' else -1
+        for tag_id in instance.tags.values_list('id', flat=True):
+            deltas[counters.tag_key(tag_id)] = delta
+    counters.apply_deltas(deltas)
+
+
+# Publishing or unpublishing a post adds it to or removes it from the similar posts
+# - of others, and a new publish date changes its place among equally similar posts.
+@receiver(post_save, sender=Post)
+def update_similar_posts(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    if instance._previous_status != instance.status or (
+        instance.status == 'published' and instance._previous_publish != instance.publish
+    ):
+        refresh_similar_posts(instance)
+
+
+# The tag index only holds published posts, ordered by publish.
+@receiver(post_save, sender=Post)
+def update_tag_index(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created or instance._previous_status != instance.status or (
+        instance.status == 'published' and instance._previous_publish != instance.publish
+    ):
+        tag_index.update_post(instance)
+
+
+# The sidebar lists the latest and the most commented published posts by title.
+@receiver(post_save, sender=Post)
+def invalidate_sidebar(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    if instance._previous_status != instance.status:
+        bump_sidebar()
+    elif instance.status == 'published' and (
+        instance._previous_publish != instance.publish
+        or instance._previous_title != instance.title
+        or instance._previous_slug != instance.slug
+    ):
+        bump_sidebar()
+
+
+# Search results change when a post is published or unpublished, or a published
+# - post is edited.
+@receiver(post_save, sender=Post)
+def invalidate_search_results(sender, instance, raw, **kwargs):
+    if not raw and 'published' in (instance._previous_status, instance.status):
+        bump_search()
+
+
+# The feeds list the latest published posts.
+@receiver(post_save, sender=Post)
+def invalidate_feed(sender, instance, raw, **kwargs):
+    if not raw and 'published' in (instance._previous_status, instance.status):
+        bump_feed()
+
+
+# The BM25 search index (when it's the search backend) holds the title and body of
+# - every published post.
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, raw, **kwargs):
+    if not raw and bm25_index.enabled() and 'published' in (instance._previous_status, instance.status):
+        bm25_index.update_post(instance)
+
+
+# The search box autocompletes the titles of the published posts.
+@receiver(post_save, sender=Post)
+def update_autocomplete(sender, instance, raw, **kwargs):
+    if not raw and 'published' in (instance._previous_status, instance.status):
+        autocomplete_index.update_post(instance)
+
+
+# The tagged items and similar posts of a post are deleted along with it, so collect
+# - its tags and the posts that listed it as similar first.
+@receiver(pre_delete, sender=Post)
+def remember_deleted_relations(sender, instance, **kwargs):
+    instance._deleted_tag_ids = list(instance.tags.values_list('id', flat=True))
+    instance._listed_by = posts_listing(instance)
+
+
+@receiver(post_delete, sender=Post)
+def update_counters_on_delete(sender, instance, **kwargs):
+    deltas = {counters.status_key(instance.status): -1}
+    if instance.status == 'published':
+        for tag_id in instance._deleted_tag_ids:
+            deltas[counters.tag_key(tag_id)] = -1
+    counters.apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_tag_index(sender, instance, **kwargs):
+    tag_index.remove_post(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_sidebar_on_delete(sender, instance, **kwargs):
+    if instance.status == 'published':
+        bump_sidebar()
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_search_results_on_delete(sender, instance, **kwargs):
+    if instance.status == 'published':
+        bump_search()
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_feed_on_delete(sender, instance, **kwargs):
+    if instance.status == 'published':
+        bump_feed()
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+    if bm25_index.enabled() and instance.status == 'published':
+        bm25_index.remove_post(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    if instance.status == 'published':
+        autocomplete_index.remove_post(instance.pk)
+
+
+# Give the posts that listed the deleted post a replacement.
+@receiver(post_delete, sender=Post)
+def update_similar_posts_on_delete(sender, instance, **kwargs):
+    for post in Post.objects.filter(id__in=instance._listed_by).only('id', 'status'):
+        rebuild_similar_posts(post)
+
+
+####
+# Tag signals
+####
+
+# taggit sends m2m_changed for add(), remove(), set() and clear(). The tagged
+# - item table is shared by every taggable model, so check the instance type.
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_tag_counters(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post):
+        return
+    if action == 'pre_clear':
+        # clear() doesn't send the ids it removes, so collect them beforehand.
+        instance._cleared_tag_ids = set(instance.tags.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear') or instance.status != 'published':
+        return
+    if action == 'post_clear':
+        pk_set = instance._cleared_tag_ids
+    delta = 1 if action == 'post_add' else -1
+    counters.apply_deltas({counters.tag_key(tag_id): delta for tag_id in pk_set})
+
+
+# A published post with different tags has different similar posts.
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_similar_posts_on_tag_change(sender, instance, action, **kwargs):
+    if isinstance(instance, Post) and instance.status == 'published' and action in (
+        'post_add', 'post_remove', 'post_clear'
+    ):
+        refresh_similar_posts(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_tag_index_on_tag_change(sender, instance, action, **kwargs):
+    if isinstance(instance, Post) and instance.status == 'published' and action in (
+        'post_add', 'post_remove', 'post_clear'
+    ):
+        tag_index.update_post(instance)
+
+
+# Fuzzy search also matches the tag names of published posts.
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_search_results_on_tag_change(sender, instance, action, **kwargs):
+    if isinstance(instance, Post) and instance.status == 'published' and action in (
+        'post_add', 'post_remove', 'post_clear'
+    ):
+        bump_search()
+
+
+# The tag feeds list the latest published posts with the tag.
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_feed_on_tag_change(sender, instance, action, **kwargs):
+    if isinstance(instance, Post) and instance.status == 'published' and action in (
+        'post_add', 'post_remove', 'post_clear'
+    ):
+        bump_feed()
+
+
+# The title of a tag feed shows the tag name.
+@receiver(post_save, sender=Tag)
+def invalidate_feed_on_tag_save(sender, instance, created, raw, **kwargs):
+    if not raw and not created:
+        bump_feed()
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_feed_on_tag_delete(sender, instance, **kwargs):
+    bump_feed()
+
+
+@receiver(post_save, sender=Tag)
+def update_tag_autocomplete(sender, instance, raw, **kwargs):
+    if not raw:
+        autocomplete_index.update_tag(instance)
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_from_autocomplete(sender, instance, **kwargs):
+    autocomplete_index.remove_tag(instance.pk)
+
+
+@receiver(post_delete, sender=Tag)
+def drop_tag_counter(sender, instance, **kwargs):
+    counters.drop(counters.tag_key(instance.pk))
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_from_index(sender, instance, **kwargs):
+    tag_index.remove_tag(instance.pk)
+
+
+####
+# Comment signals
+####
+
+# Remember whether the comment was active (and on which post) before this save,
+# - so moderation in the admin moves the active comment counter.
+@receiver(pre_save, sender=Comment)
+def remember_previous_comment_state(sender, instance, raw, **kwargs):
+    instance._previous_state = None
+    if instance.pk and not raw:
+        instance._previous_state = Comment.objects.filter(
+            pk=instance.pk
+        ).values_list('post_id', 'active').first()
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_counters(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    total, active = {instance.post_id: 1}, {instance.post_id: int(instance.active)}
+    if instance._previous_state:
+        previous_post_id, previous_active = instance._previous_state
+        total[previous_post_id] = total.get(previous_post_id, 0) - 1
+        active[previous_post_id] = active.get(previous_post_id, 0) - int(previous_active)
+    for post_id in total:
+        counters.add_comments(post_id, total=total[post_id], active=active[post_id])
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_counters_on_delete(sender, instance, **kwargs):
+    counters.add_comments(instance.post_id, total=-1, active=-int(instance.active))
+
+
+# New and deleted comments change the most commented posts; so does moderation.
+@receiver(post_save, sender=Comment)
+def invalidate_sidebar_on_comment(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created or instance._previous_state != (instance.post_id, instance.active):
+        bump_sidebar()
+
+
+@receiver(post_delete, sender=Comment)
+def invalidate_sidebar_on_comment_delete(sender, instance, **kwargs):
+    bump_sidebar()
+
+
+####
+# Request signals
+####
+
+# The in-memory indexes are built when the process serves its first request.
+@receiver(request_started)
+def warm_indexes(sender, **kwargs):
+    warm_tag_index()
+    warm_search_index()
+    warm_autocomplete_index()
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Window
+from django.db.models.functions import RowNumber
+
+from .models import Post, SimilarPost
+
+
+# Number of similar posts stored per post. post_detail shows 4 of them.
+def similar_posts_kept():
+    return getattr(settings, 'BLOG_SIMILAR_POSTS_KEPT', 10)
+
+
+# Published posts that share tags with the post as (id, publish, shared tags)
+# - rows, best first. This is the expensive query post_detail used to run live.
+def shared_tag_counts(post):
+    tag_ids = list(post.tags.values_list('id', flat=True))
+    if not tag_ids:
+        return []
+    return list(
+        Post.published.filter(tags__in=tag_ids).exclude(id=post.id).annotate(
+            score=Count('tags')
+        ).order_by('-score', '-publish').values_list('id', 'publish', 'score')
+    )
+
+
+# Replace the stored similar posts of one post with its current top ones.
+def rebuild_similar_posts(post, overlaps=None):
+    SimilarPost.objects.filter(post=post).delete()
+    if post.status != 'published':
+        return
+    if overlaps is None:
+        overlaps = shared_tag_counts(post)
+    SimilarPost.objects.bulk_create([
+        SimilarPost(post=post, similar_id=pk, similar_publish=publish, score=score)
+        for pk, publish, score in overlaps[:similar_posts_kept()]
+    ])
+
+
+# Keep only the best similar_posts_kept() rows of the given posts.
+def _trim(post_ids):
+    ranked = SimilarPost.objects.filter(post_id__in=post_ids).annotate(
+        rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('post_id')],
+            order_by=[F('score').desc(), F('similar_publish').desc()],
+        )
+    ).values_list('id', 'rank')
+    extra = [pk for pk, rank in ranked if rank > similar_posts_kept()]
+    if extra:
+        SimilarPost.objects.filter(id__in=extra).delete()
+
+
+# Offer the post as a similar post to other posts ({id: score}). It is only
+# - stored where it beats the weakest similar post currently kept.
+def _offer(post, scores, chunk_size=500):
+    ids = list(scores)
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        current = {
+            row['post_id']: row
+            for row in SimilarPost.objects.filter(post_id__in=chunk).values('post_id').annotate(
+                kept=Count('id'), weakest=Min('score'),
+            )
+        }
+        rows = []
+        full = []
+        for pk in chunk:
+            row = current.get(pk)
+            if row and row['kept'] >= similar_posts_kept():
+                if scores[pk] < row['weakest']:
+                    continue
+                full.append(pk)
+            rows.append(SimilarPost(post_id=pk, similar=post, similar_publish=post.publish, score=scores[pk]))
+        SimilarPost.objects.bulk_create(rows)
+        if full:
+            _trim(full)
+
+
+# Bring the table up to date after a post's tags, status or publish date changed.
+# - Only the post itself and the posts it shares tags with are touched.
+@transaction.atomic
+def refresh_similar_posts(post):
+    # Posts that listed this post may have to fill the gap it leaves with
+    # - a post that wasn't stored, so their lists are rebuilt in full.
+    listed_by = set(SimilarPost.objects.filter(similar=post).values_list('post_id', flat=True))
+    SimilarPost.objects.filter(similar=post).delete()
+
+    overlaps = shared_tag_counts(post) if post.status == 'published' else []
+    rebuild_similar_posts(post, overlaps)
+    for other in Post.objects.filter(id__in=listed_by).only('id', 'status'):
+        rebuild_similar_posts(other)
+    _offer(post, {pk: score for pk, publish, score in overlaps if pk not in listed_by})
+
+
+# refresh_similar_posts() for many posts whose status changed together (bulk
+# - publishing). A post listing several of them is rebuilt once, not once per post.
+@transaction.atomic
+def refresh_similar_posts_bulk(posts):
+    ids = {post.pk for post in posts}
+    listed_by = set(SimilarPost.objects.filter(similar_id__in=ids).values_list('post_id', flat=True)) - ids
+    SimilarPost.objects.filter(similar_id__in=ids).delete()
+
+    offers = {}
+    for post in posts:
+        overlaps = shared_tag_counts(post) if post.status == 'published' else []
+        rebuild_similar_posts(post, overlaps)
+        # The posts of the batch were just rebuilt with each other in mind.
+        offers[post] = {pk: score for pk, publish, score in overlaps if pk not in listed_by and pk not in ids}
+    for other in Post.objects.filter(id__in=listed_by).only('id', 'status'):
+        rebuild_similar_posts(other)
+    for post, scores in offers.items():
+        _offer(post, scores)
+
+
+# The posts that listed a post that is going to be deleted. Their rows for it
+# - disappear with the post (on_delete=CASCADE), but they need a replacement.
+def posts_listing(post):
+    return list(SimilarPost.objects.filter(similar=post).values_list('post_id', flat=True))
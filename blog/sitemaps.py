@@ -1,20 +1,160 @@
-from django.contrib.sitemaps import Sitemap
-from .models import Post
+import gzip
+import json
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db.models import Count, F, Max, Sum
+from django.urls import reverse
 
+from .models import Post
 
 # Open http://127.0.0.1:8000/admin/sites/site/ in your browser and update the site domain and display name.
 
-class PostSitemap(Sitemap):
-    # The changefreq and priority attributes indicate the change frequency of your post
-    # - pages and their relevance in your website (the maximum value is 1).
-    changefreq = 'weekly'
-    priority = 0.9
+DEFAULT_SITEMAP = {
+    'ROOT': 'sitemaps',
+    'SECTION_SIZE': 10000,
+    'PROTOCOL': 'https',
+}
+
+INDEX_FILE = 'sitemap.xml.gz'
+MANIFEST_FILE = 'manifest.json'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+# The changefreq and priority of the post pages: they indicate the change frequency
+# - of your post pages and their relevance in your website (the maximum value is 1).
+CHANGEFREQ = 'weekly'
+PRIORITY = '0.9'
+
+
+def sitemap_settings():
+    return {**DEFAULT_SITEMAP, **getattr(settings, 'BLOG_SITEMAP', {})}
+
+
+def section_file(number):
+    return f'sitemap-posts-{number}.xml.gz'
+
+
+def sitemap_path(filename):
+    return os.path.join(sitemap_settings()['ROOT'], filename)
+
+
+# The URL of a post detail page as a format string taking (year, month, day, slug).
+# - The URL pattern is reversed once with marker arguments, instead of once per post.
+def post_url_format():
+    markers = ['918273', '564738', '102938', 'sitemap-slug-marker']
+    url = reverse('blog:post_detail', args=markers).replace('{', '{{').replace('}', '}}')
+    for position, marker in enumerate(markers):
+        url = url.replace(marker, f'{{{position}}}')
+    return url
+
+
+# Write a gzipped file next to its final path and move it into place, so a crawler
+# - never gets a half written file.
+def write_gzip(path, chunks):
+    directory = os.path.dirname(path)
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as out:
+            for chunk in chunks:
+                out.write(chunk.encode())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+####
+# Sections
+####
+
+# The published posts are split into sections of SECTION_SIZE consecutive ids, so a
+# - post always stays in the same section. Every section is summed up as
+# - (posts, sum of the ids, newest update) in one grouped query; a section whose
+# - summary changed since it was written (a post was published, edited,
+# - unpublished or deleted) is written again.
+def section_summaries(size):
+    rows = (
+        Post.published.annotate(section=F('id') / size)
+        .order_by()
+        .values('section')
+        .annotate(posts=Count('id'), ids=Sum('id'), lastmod=Max('updated'))
+        .values_list('section', 'posts', 'ids', 'lastmod')
+    )
+    return {section: [posts, ids, lastmod.isoformat()] for section, posts, ids, lastmod in rows}
+
+
+# The <url> entries of one section, streamed from a values_list() of its posts.
+def section_chunks(number, size, base_url, url_format):
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS}">\n'
+    rows = (
+        Post.published.filter(id__gte=number * size, id__lt=(number + 1) * size)
+        .order_by('id')
+        .values_list('publish', 'slug', 'updated')
+    )
+    for publish, slug, updated in rows.iterator():
+        loc = base_url + url_format.format(publish.year, publish.month, publish.day, slug)
+        yield (
+            f'<url><loc>{escape(loc)}</loc><lastmod>{updated:%Y-%m-%d}</lastmod>'
+            f'<changefreq>{CHANGEFREQ}</changefreq><priority>{PRIORITY}</priority></url>\n'
+        )
+    yield '</urlset>\n'
+
+
+def index_chunks(summaries, base_url):
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{XMLNS}">\n'
+    for number in sorted(summaries):
+        loc = base_url + reverse('sitemap_section', args=[number])
+        lastmod = summaries[number][2][:10]
+        yield f'<sitemap><loc>{escape(loc)}</loc><lastmod>{lastmod}</lastmod></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def _read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_FILE)) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as out:
+        json.dump(manifest, out)
+    os.replace(path + '.tmp', path)
+
+
+# Bring the sitemap files up to date and return the numbers of the sections that
+# - were written. With force=True every section is written again.
+def build_sitemaps(force=False):
+    options = sitemap_settings()
+    root, size = options['ROOT'], options['SECTION_SIZE']
+    os.makedirs(root, exist_ok=True)
+    base_url = f"{options['PROTOCOL']}://{Site.objects.get_current().domain}"
+
+    manifest = _read_manifest(root)
+    previous = {int(number): summary for number, summary in manifest.get('sections', {}).items()}
+    # Another section size or domain changes every file.
+    if force or manifest.get('size') != size or manifest.get('base_url') != base_url:
+        previous = {}
+    summaries = section_summaries(size)
 
-    # The items() method returns the QuerySet of objects to include in this sitemap.
-    def items(self):
-        return Post.published.all()
+    url_format = post_url_format()
+    written = []
+    for number, summary in sorted(summaries.items()):
+        if previous.get(number) != summary or not os.path.exists(os.path.join(root, section_file(number))):
+            write_gzip(os.path.join(root, section_file(number)), section_chunks(number, size, base_url, url_format))
+            written.append(number)
+    for number in set(previous) - set(summaries):
+        try:
+            os.unlink(os.path.join(root, section_file(number)))
+        except FileNotFoundError:
+            pass
 
-    # The lastmod method receives each object returned by items() and returns the
-    # - last time the object was modified.
-    def lastmod(self, obj):
-        return obj.updated
+    if written or previous.keys() != summaries.keys() or not os.path.exists(os.path.join(root, INDEX_FILE)):
+        write_gzip(os.path.join(root, INDEX_FILE), index_chunks(summaries, base_url))
+    _write_manifest(root, {'size': size, 'base_url': base_url, 'sections': summaries})
+    return written
@@ -0,0 +1,214 @@
+import calendar
+import heapq
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from .indexing import InMemoryIndex
+from .models import Post
+
+GENERATION = 'tag_index'
+
+
+# Sort key of a post: (publish as integer microseconds since the epoch, id).
+def post_key(publish, pk):
+    return calendar.timegm(publish.utctimetuple()) * 1000000 + publish.microsecond, pk
+
+
+# Position of a key in the parallel (timestamps, ids) arrays of a posting list:
+# - the first entry not below the key, or with right=True the first one above it.
+def _bisect(stamps, ids, key, right=False):
+    low, high = 0, len(stamps)
+    while low < high:
+        middle = (low + high) // 2
+        entry = (stamps[middle], ids[middle])
+        if entry < key or (right and entry == key):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+# In-process inverted index from tag id to the published posts carrying the tag.
+# - Every posting list is a pair of compact arrays (publish timestamps and post ids)
+# - sorted by (publish, id), so tag pages and tag overlap rankings are answered
+# - without SQL. It's built and kept up to date like every InMemoryIndex, and reports
+# - itself cold (None results) while it's building or after another process changed
+# - the tags; callers then fall back to the ORM.
+class TagIndex(InMemoryIndex):
+    generation_name = GENERATION
+    label = 'tag index'
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._post_tags = {}
+        self._post_keys = {}
+
+    ####
+    # Building
+    ####
+
+    def enabled(self):
+        return getattr(settings, 'BLOG_TAG_INDEX', True)
+
+    # Load every published post and its tags from the database.
+    def load(self):
+        post_keys = {
+            pk: post_key(publish, pk)
+            for pk, publish in Post.published.values_list('id', 'publish').iterator()
+        }
+        post_tags = {}
+        tagged = Post.tags.through.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post),
+        ).values_list('object_id', 'tag_id')
+        for post_id, tag_id in tagged.iterator():
+            if post_id in post_keys:
+                post_tags.setdefault(post_id, []).append(tag_id)
+
+        unsorted = {}
+        for post_id, tag_ids in post_tags.items():
+            for tag_id in tag_ids:
+                unsorted.setdefault(tag_id, []).append(post_keys[post_id])
+        postings = {}
+        for tag_id, keys in unsorted.items():
+            keys.sort()
+            postings[tag_id] = (array('q', (k[0] for k in keys)), array('q', (k[1] for k in keys)))
+        return postings, post_tags, post_keys
+
+    def install(self, state):
+        postings, post_tags, post_keys = state
+        self._postings = postings
+        self._post_tags = {pk: tuple(tags) for pk, tags in post_tags.items()}
+        self._post_keys = post_keys
+
+    def describe(self):
+        return f'{len(self._post_keys)} posts and {len(self._postings)} tags'
+
+    ####
+    # Updates
+    ####
+
+    # Record the current state of a post: its publish date, tags and whether it's
+    # - published. Applied once the transaction commits, in this process right away
+    # - and in every other process through the generation.
+    def update_post(self, post, tag_ids=None):
+        if post.status == 'published' and tag_ids is None:
+            tag_ids = list(post.tags.values_list('id', flat=True))
+        change = self._post_change(post, tag_ids)
+        transaction.on_commit(lambda: self.update(*change))
+
+    # The same for many posts at once, with their tags as {post id: tag ids}.
+    def update_posts(self, posts, tag_ids):
+        changes = [self._post_change(post, tag_ids.get(post.pk)) for post in posts]
+        transaction.on_commit(lambda: self.update_many(changes))
+
+    @staticmethod
+    def _post_change(post, tag_ids):
+        return post.pk, post.publish, tag_ids or (), post.status == 'published'
+
+    def remove_post(self, pk):
+        transaction.on_commit(lambda: self.update(pk, None, (), False))
+
+    def remove_tag(self, tag_id):
+        transaction.on_commit(lambda: self._update_tag(tag_id))
+
+    def _update_tag(self, tag_id):
+        with self._lock:
+            _, ids = self._postings.pop(tag_id, (None, ()))
+            for pk in ids:
+                tags = self._post_tags.get(pk, ())
+                self._post_tags[pk] = tuple(t for t in tags if t != tag_id)
+            self.advance()
+
+    def apply(self, pk, publish, tag_ids, published):
+        old_key = self._post_keys.pop(pk, None)
+        for tag_id in self._post_tags.pop(pk, ()):
+            stamps, ids = self._postings[tag_id]
+            position = _bisect(stamps, ids, old_key)
+            del stamps[position]
+            del ids[position]
+            if not ids:
+                del self._postings[tag_id]
+        if not published:
+            return
+        key = post_key(publish, pk)
+        self._post_keys[pk] = key
+        self._post_tags[pk] = tuple(tag_ids)
+        for tag_id in tag_ids:
+            stamps, ids = self._postings.setdefault(tag_id, (array('q'), array('q')))
+            position = _bisect(stamps, ids, key)
+            stamps.insert(position, key[0])
+            ids.insert(position, pk)
+
+    ####
+    # Queries (they return None when the index is cold)
+    ####
+
+    # Ids of the published posts sharing the most tags with the post, best first,
+    # - as (id, shared tags) pairs. Ties go to the most recent posts. Only copying the
+    # - posting lists of the post's tags holds the lock; they're ranked after it's released.
+    def similar_posts(self, pk, limit):
+        if not self.warm:
+            return None
+        with self._lock:
+            postings = [
+                (stamps[:], ids[:])
+                for stamps, ids in (self._postings[tag_id] for tag_id in self._post_tags.get(pk, ()))
+            ]
+        shared = Counter()
+        stamps_by_id = {}
+        for stamps, ids in postings:
+            shared.update(ids)
+            stamps_by_id.update(zip(ids, stamps))
+        shared.pop(pk, None)
+        return heapq.nlargest(
+            limit, shared.items(), key=lambda item: (item[1], stamps_by_id[item[0]], item[0])
+        )
+
+    # Number of published posts with the tag.
+    def tag_count(self, tag_id):
+        if not self.warm:
+            return None
+        with self._lock:
+            return len(self._postings.get(tag_id, ((), ()))[1])
+
+    # Ids of the published posts with the tag, newest first, from position start to stop.
+    def tag_range(self, tag_id, start, stop):
+        if not self.warm:
+            return None
+        with self._lock:
+            ids = self._postings.get(tag_id, ((), ()))[1]
+            end = max(len(ids) - start, 0)
+            return list(reversed(ids[max(len(ids) - stop, 0):end]))
+
+    # Ids of the published posts with the tag, newest first, for page `number` (from 1).
+    def tag_page(self, tag_id, number, per_page):
+        return self.tag_range(tag_id, (number - 1) * per_page, number * per_page)
+
+    # Keyset access: up to `limit` ids of the published posts with the tag that
+    # - are older than `before` (newest first) or newer than `after` (oldest first).
+    # - Both are (publish, id) pairs; with neither, the newest posts are returned.
+    def tag_slice(self, tag_id, limit, before=None, after=None):
+        if not self.warm:
+            return None
+        with self._lock:
+            stamps, ids = self._postings.get(tag_id, ((), ()))
+            if after is not None:
+                start = _bisect(stamps, ids, post_key(*after), right=True)
+                return list(ids[start:start + limit])
+            end = _bisect(stamps, ids, post_key(*before)) if before is not None else len(ids)
+            return list(reversed(ids[max(end - limit, 0):end]))
+
+
+tag_index = TagIndex()
+
+
+# Build the index the first time the process serves a request, so management
+# - commands and migrations never pay for it.
+def warm_tag_index(**kwargs):
+    if tag_index.enabled() and not tag_index.built:
+        tag_index.rebuild_in_background()
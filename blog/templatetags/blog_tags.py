@@ -1,9 +1,10 @@
 from django import template
-from django.db.models import Count
 from django.utils.safestring import mark_safe
-import markdown
 
+from ..cache import SIDEBAR_GENERATION, get_generation
+from ..counters import count_posts, status_key
 from ..models import Post
+from ..rendering import render_markdown_cached
 
 register = template.Library()
 
@@ -12,22 +13,28 @@ register = template.Library()
 # Register as simple tags
 ####
 
-# A simple template tag that returns the number of posts published so far.=
+# A simple template tag that returns the number of posts published so far.
+# - It reads the published posts counter instead of counting the table.
 @register.simple_tag
 def total_posts():
-    return Post.published.count()
+    return count_posts(Post.published.all(), status_key('published'))
 
 
 # A simple template tag that displays the 5 most commented posts
 @register.simple_tag
 def get_most_commented_posts(count=5):
-    # Build a QuerySet using the annotate() function to aggregate the
-    # - total number of comments for each post.
-    return Post.published.annotate(
-        # use the Count aggregation function to store the number of comments
-        # - in the computed field total_comments for each Post object.
-        total_comments=Count('comments')
-    ).order_by('-total_comments')[:count]
+    # Posts keep a denormalized comment_count, so this is a top-N scan of the
+    # - (status, -comment_count) index instead of counting every comment.
+    # The sidebar only links to the posts, so their bodies are not loaded.
+    return Post.published.only('title', 'slug', 'publish').order_by('-comment_count')[:count]
+
+
+# The generation the cached sidebar fragment is keyed on. It is bumped by the signal
+# - handlers in blog/signals.py whenever a post is published or unpublished or a
+# - comment is added or moderated, so the sidebar is only rebuilt when it changes.
+@register.simple_tag
+def sidebar_generation():
+    return get_generation(SIDEBAR_GENERATION)
 
 
 ####
@@ -37,7 +44,7 @@ def get_most_commented_posts(count=5):
 # An inclusion tag that returns the 5 latest posts.
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by('-publish')[:count]
+    latest_posts = Post.published.only('title', 'slug', 'publish').order_by('-publish')[:count]
     return {
         'latest_posts': latest_posts
     }
@@ -48,7 +55,9 @@ def show_latest_posts(count=5):
 ####
 
 # A template filter to enable use of markdown .md syntax in blog posts and then converts
-# - post contents to HTML in the templates
+# - post contents to HTML in the templates. Post bodies don't need it: use the
+# - pre-rendered post.rendered_body and post.rendered_excerpt instead.
+# - Renders are memoized, so identical texts are converted once per process.
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
+    return mark_safe(render_markdown_cached(text))
@@ -1,3 +1,1211 @@
-from django.test import TestCase
+import gzip
+import io
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from importlib import import_module
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchQuery
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import utc
+from taggit.models import Tag
+
+from .admin import CommentAdmin, PostAdmin
+from .autocomplete import autocomplete_index
+from . import counters
+from .cache import SEARCH_GENERATION, SIDEBAR_GENERATION, LRUCache, bump_generation, get_generation
+from .digest import send_digest
+from .models import Comment, DigestRun, OutboxMessage, Post, PostCounter, SimilarPost, Subscriber
+from .moderation import set_comments_active, set_posts_status
+from .outbox import claim, drain_outbox
+from .rendering import render_signature
+from .pagination import (
+    EstimatedCountPaginator, InvalidCursor, KeysetPaginator, TagIndexPaginator, encode_cursor,
+)
+from .search import SearchBackend, get_backend, search_hits
+from .search.results import SearchPaginator, result_cache
+from .search.bm25 import bm25_index
+from .search.highlight import body_heads
+from .search.postgres import fuzzy_search_posts, search_posts
+from .search.vocabulary import build_vocabulary
+from .similarity import rebuild_similar_posts
+from .sitemaps import build_sitemaps
+from .tag_index import tag_index
+
+
+# Keyset pages follow (publish, id) cursors; posts published at the same time are
+# - ordered by id, so none is skipped or shown twice.
+@override_settings(BLOG_TAG_INDEX=False, BLOG_POSTS_PER_PAGE=2)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        publish = timezone.now()
+        # Posts 2 to 5 share a publish time, across page boundaries.
+        for i, hours in enumerate([0, 1, 2, 2, 2, 2, 3]):
+            Post.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', author=author, body='Body.', status='published',
+                publish=publish - timedelta(hours=hours),
+            )
+
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+
+    def page(self, cursor=None):
+        response = self.client.get(reverse('blog:post_list'), {'cursor': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.context['posts']
+
+    def test_cursors_walk_every_post_in_order_and_back(self):
+        expected = list(Post.published.order_by('-publish', '-pk').values_list('pk', flat=True))
+        pages = [self.page()]
+        while pages[-1].has_next():
+            pages.append(self.page(pages[-1].next_cursor))
+        self.assertEqual([post.pk for page in pages for post in page], expected)
+        self.assertEqual(len(pages), 4)
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = self.page(page.previous_cursor)
+            self.assertEqual(list(page), list(previous))
+        self.assertFalse(page.has_previous())
+
+    def test_invalid_cursors_show_the_first_page(self):
+        first = list(self.page())
+        tampered = [
+            'not a cursor',
+            encode_cursor('sideways', ['2020-01-01T00:00:00+00:00', 1]),
+            encode_cursor('next', ['yesterday', 1]),
+            encode_cursor('next', ['2020-01-01T00:00:00+00:00', '1']),
+            encode_cursor('prev', []),
+        ]
+        for cursor in tampered:
+            self.assertEqual(list(self.page(cursor)), first)
+            with self.assertRaises(InvalidCursor):
+                KeysetPaginator(Post.published.all(), 2).page(cursor)
+
+
+# Search results are paged over the ranked (id, rank) hits, on any database.
+@override_settings(BLOG_TAG_INDEX=False)
+class SearchPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        for i in range(7):
+            Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body='Body.', status='published')
+
+    def setUp(self):
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        # Ranks 2 to 5 are tied across page boundaries; ties are ordered by id descending.
+        ranks = [0.9, 0.5, 0.5, 0.5, 0.5, 0.2, 0.1]
+        pks = list(Post.published.order_by('pk').values_list('pk', flat=True))
+        self.hits = sorted(zip(pks, ranks), key=lambda hit: (-hit[1], -hit[0]))
+
+    def paginator(self, max_results=None):
+        return SearchPaginator(self.hits, 2, Post.published.all(), max_results)
+
+    def test_cursors_walk_every_hit_in_order_and_back(self):
+        paginator = self.paginator()
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([(post.pk, post.rank) for page in pages for post in page], self.hits)
+        self.assertEqual(len(pages), 4)
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = paginator.page(page.previous_cursor)
+            self.assertEqual(list(page), list(previous))
+            self.assertEqual(page.start, previous.start)
+        self.assertFalse(page.has_previous())
+
+    def test_results_stop_at_max_results(self):
+        paginator = self.paginator(max_results=5)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([post.pk for page in pages for post in page], [pk for pk, rank in self.hits[:5]])
+        self.assertEqual(len(pages[-1]), 1)
+
+    def test_invalid_cursors_are_rejected(self):
+        tampered = [
+            'not a cursor',
+            encode_cursor('next', [0.5, 1]),
+            encode_cursor('next', ['0.5', 1, 2]),
+            encode_cursor('next', [0.5, '1', 2]),
+            encode_cursor('prev', [0.5, 1, None]),
+        ]
+        for cursor in tampered:
+            with self.assertRaises(InvalidCursor):
+                self.paginator().page(cursor)
+
+
+# The per process LRU behind the markdown and search result caches.
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_entries_are_evicted_first(self):
+        lru = LRUCache(3)
+        for key in 'abc':
+            lru.set(key, key.upper())
+        lru.get('a')
+        lru.set('d', 'D')
+        self.assertEqual([key for key in 'abcd' if key in lru], ['a', 'c', 'd'])
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+    def test_size_cap_counts_utf8_bytes(self):
+        lru = LRUCache(10, max_bytes=10)
+        lru.set('a', 'ééé')
+        lru.set('b', 'ab')
+        self.assertEqual(lru.bytes, 8)
+        lru.set('c', 'éé')
+        self.assertEqual([key for key in 'abc' if key in lru], ['b', 'c'])
+        self.assertEqual(lru.bytes, 6)
+        # A value bigger than the whole cache is not kept.
+        lru.set('d', 'é' * 6)
+        self.assertNotIn('d', lru)
+        self.assertEqual(len(lru), 2)
+
+
+# The post list must not issue queries per post: authors are joined in and the
+# - tags of a whole page are prefetched, so the count only depends on the page layout.
+@override_settings(BLOG_TAG_INDEX=False)
+class PostListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        for i in range(12):
+            post = Post.objects.create(
+                title=f'Post {i}',
+                slug=f'post-{i}',
+                author=author,
+                body='Some *markdown* body.',
+                status='published',
+            )
+            post.tags.add('django', f'tag-{i}')
+
+    def setUp(self):
+        cache.clear()
+
+    # Number of queries of a warm request (the post counters are seeded by the first one).
+    def count_queries(self, url, per_page):
+        with override_settings(BLOG_POSTS_PER_PAGE=per_page):
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['posts']), per_page)
+        return len(queries)
+
+    def test_post_list_query_count(self):
+        # Page and tags prefetch; the sidebar is served from the fragment cache.
+        self.assertEqual(self.count_queries(reverse('blog:post_list'), 3), 2)
+
+    def test_post_list_query_count_does_not_grow_with_page_size(self):
+        url = reverse('blog:post_list')
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 10))
+
+    def test_tag_list_query_count_does_not_grow_with_page_size(self):
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 10))
+
+    @override_settings(BLOG_PAGINATION='offset')
+    def test_numbered_post_list_query_count_does_not_grow_with_page_size(self):
+        url = reverse('blog:post_list')
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 10))
+
+
+# The post counters follow publishing, unpublishing and deleting, in real transactions
+# - so the cached values are dropped on commit.
+@override_settings(BLOG_TAG_INDEX=False)
+class PostCounterTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='Counted', slug='counted', author=author, body='Body.')
+        self.post.tags.add('django')
+        self.tag_key = counters.tag_key(Tag.objects.get(slug='django').pk)
+        self.keys = [counters.status_key('published'), counters.status_key('draft'), self.tag_key]
+
+    def assert_counts(self, published, draft, tagged):
+        self.assertEqual([counters.get_count(key) for key in self.keys], [published, draft, tagged])
+        self.assertEqual([counters.exact_count(key) for key in self.keys], [published, draft, tagged])
+
+    def set_status(self, status):
+        self.post.status = status
+        self.post.save()
+
+    def test_counters_follow_publishing_and_deleting(self):
+        self.assert_counts(0, 1, 0)
+        self.set_status('published')
+        self.assert_counts(1, 0, 1)
+        self.set_status('draft')
+        self.assert_counts(0, 1, 0)
+        self.set_status('published')
+        self.post.delete()
+        self.assert_counts(0, 0, 0)
+
+    def test_a_counter_first_seeded_by_a_change_counts_it_once(self):
+        # Only creating the draft has touched a counter so far.
+        self.assertEqual(list(PostCounter.objects.values_list('key', flat=True)), [counters.status_key('draft')])
+        self.set_status('published')
+        self.assertEqual(
+            dict(PostCounter.objects.values_list('key', 'value')),
+            {counters.status_key('published'): 1, counters.status_key('draft'): 0, self.tag_key: 1},
+        )
+
+
+# Posts store their rendered HTML; posts rendered by an older markdown setup are
+# - rendered on the fly until `manage.py render_posts` stores them again.
+@override_settings(BLOG_TAG_INDEX=False)
+class RenderingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        author = User.objects.create_user('author')
+        for i in range(3):
+            Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body=f'Some *markdown* {i}.', status='published')
+
+    def list_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blog:post_list'))
+        return response, len(queries)
+
+    def make_stale(self):
+        Post.objects.update(render_signature='stale', excerpt_html='<p>Old excerpt</p>', body_html='<p>Old</p>')
+
+    def test_stored_html_is_rendered(self):
+        post = Post.objects.get(slug='post-0')
+        self.assertEqual(post.body_html, '<p>Some <em>markdown</em> 0.</p>')
+        self.assertEqual(post.rendered_excerpt, post.excerpt_html)
+        self.assertContains(self.client.get(post.get_absolute_url()), '<em>markdown</em> 0.')
+
+    def test_stale_posts_are_rendered_without_a_query_each(self):
+        self.list_page()
+        _, fresh_queries = self.list_page()
+        self.make_stale()
+        response, stale_queries = self.list_page()
+        self.assertEqual(stale_queries, fresh_queries)
+        self.assertNotContains(response, 'Old excerpt')
+        self.assertContains(response, '<em>markdown</em> 2.')
+
+    def test_render_posts_stores_the_stale_posts_again(self):
+        self.make_stale()
+        out = io.StringIO()
+        call_command('render_posts', stdout=out)
+        self.assertIn('Rendered 3 posts.', out.getvalue())
+        post = Post.objects.get(slug='post-1')
+        self.assertEqual(post.render_signature, render_signature())
+        self.assertEqual(post.body_html, '<p>Some <em>markdown</em> 1.</p>')
+        call_command('render_posts', stdout=out)
+        self.assertIn('Rendered 0 posts.', out.getvalue())
+
+    def test_saving_other_fields_does_not_render_the_body(self):
+        # A draft, so the search indexes don't read the body either: the previous
+        # - state and the UPDATE are the only queries.
+        Post.objects.filter(slug='post-0').update(status='draft')
+        post = Post.objects.defer('body').get(slug='post-0')
+        post.title = 'Renamed'
+        with patch('blog.models.render_markdown') as render, self.assertNumQueries(2):
+            post.save(update_fields=['title'])
+        render.assert_not_called()
+        # A full save of a post loaded without its body doesn't load or render it either.
+        with patch('blog.models.render_markdown') as render, self.assertNumQueries(2):
+            post.save()
+        render.assert_not_called()
+        post = Post.objects.get(slug='post-0')
+        post.body = 'New *body*.'
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).body_html, '<p>New <em>body</em>.</p>')
+
+    def test_saving_a_deleted_post_does_not_insert_it_again(self):
+        post = Post.objects.get(slug='post-0')
+        Post.objects.filter(pk=post.pk).delete()
+        with self.assertRaises(DatabaseError):
+            post.save()
+
+
+# post_detail looks posts up by a [midnight, next midnight) range of the current time zone.
+@override_settings(BLOG_TAG_INDEX=False)
+class PublishDateLookupTests(TestCase):
+    def setUp(self):
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, slug, publish):
+        return Post.objects.create(
+            title=slug, slug=slug, author=self.author, body='Body.', status='published', publish=publish,
+        )
+
+    def test_posts_published_late_in_the_day_are_found(self):
+        late = self.create_post('late', datetime(2021, 3, 1, 23, 59, 59, 999999, tzinfo=utc))
+        midnight = self.create_post('midnight', datetime(2021, 3, 2, tzinfo=utc))
+        self.assertEqual(self.client.get(late.get_absolute_url()).status_code, 200)
+        self.assertEqual(list(Post.published.on_date(2021, 3, 1)), [late])
+        self.assertEqual(list(Post.published.on_date(2021, 3, 2)), [midnight])
+        # A date that doesn't exist is a 404, not an error.
+        self.assertEqual(self.client.get(reverse('blog:post_detail', args=[2021, 2, 30, 'late'])).status_code, 404)
+
+    def test_days_follow_the_current_time_zone(self):
+        # 23:30 in New York is 04:30 the next day in UTC.
+        post = self.create_post('evening', datetime(2021, 3, 2, 4, 30, tzinfo=utc))
+        with timezone.override('America/New_York'):
+            self.assertEqual(list(Post.published.on_date(2021, 3, 1)), [post])
+            self.assertFalse(Post.published.on_date(2021, 3, 2).exists())
+
+
+# Similar posts are stored per post, best first: most shared tags, then most recent.
+@override_settings(BLOG_TAG_INDEX=False)
+class SimilarPostTests(TestCase):
+    def setUp(self):
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        self.author = User.objects.create_user('author')
+        now = timezone.now()
+        self.post = self.create_post('Main', ['a', 'b', 'c'], now)
+        self.two = self.create_post('Two', ['a', 'b'], now - timedelta(days=3))
+        self.older = self.create_post('Older', ['a'], now - timedelta(days=2))
+        self.newer = self.create_post('Newer', ['c'], now - timedelta(days=1))
+        self.create_post('Draft', ['a', 'b', 'c'], now, status='draft')
+
+    def create_post(self, title, tags, publish, status='published'):
+        post = Post.objects.create(
+            title=title, slug=title.lower(), author=self.author, body='Body.', status=status, publish=publish,
+        )
+        post.tags.add(*tags)
+        return post
+
+    def similar(self, post):
+        return list(SimilarPost.objects.filter(post=post).order_by('-score', '-similar_publish').values_list(
+            'similar__title', 'score',
+        ))
+
+    def test_similar_posts_are_ranked_by_shared_tags_then_publish(self):
+        self.assertEqual(self.similar(self.post), [('Two', 2), ('Newer', 1), ('Older', 1)])
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual([post.title for post in response.context['similar_posts']], ['Two', 'Newer', 'Older'])
+
+    def test_unpublished_posts_are_removed(self):
+        self.two.status = 'draft'
+        self.two.save()
+        self.assertEqual(self.similar(self.post), [('Newer', 1), ('Older', 1)])
+        self.assertFalse(SimilarPost.objects.filter(post=self.two).exists())
+        self.assertFalse(SimilarPost.objects.filter(similar=self.two).exists())
+
+    def test_rebuild_command_matches_the_maintained_rows(self):
+        maintained = set(SimilarPost.objects.values_list('post_id', 'similar_id', 'score'))
+        SimilarPost.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_similar_posts', stdout=out)
+        self.assertIn('Recomputed the similar posts of 4 posts.', out.getvalue())
+        self.assertEqual(set(SimilarPost.objects.values_list('post_id', 'similar_id', 'score')), maintained)
+
+    def test_migration_backfills_the_existing_posts(self):
+        maintained = set(SimilarPost.objects.values_list('post_id', 'similar_id', 'similar_publish', 'score'))
+        SimilarPost.objects.all().delete()
+        migration = import_module('blog.migrations.0016_backfill_similar_posts')
+        migration.backfill_similar_posts(apps, None)
+        self.assertEqual(
+            set(SimilarPost.objects.values_list('post_id', 'similar_id', 'similar_publish', 'score')), maintained,
+        )
+
+
+# The comment counters of a post follow its comments through F() updates.
+@override_settings(BLOG_TAG_INDEX=False)
+class CommentCounterTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='Counted', slug='counted', author=author, body='Body.', status='published')
+
+    def assert_counters(self, total, active):
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.active_comment_count), (total, active))
+
+    def test_counters_follow_comments(self):
+        comment = self.post.comments.create(name='Ann', email='ann@example.com', body='Nice.')
+        self.post.comments.create(name='Bob', email='bob@example.com', body='Spam.', active=False)
+        self.assert_counters(2, 1)
+        comment.active = False
+        comment.save()
+        self.assert_counters(2, 0)
+        comment.delete()
+        self.assert_counters(1, 0)
+
+    def test_saving_a_stale_post_keeps_the_counters(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        self.post.comments.create(name='Ann', email='ann@example.com', body='Nice.')
+        stale.title = 'Edited'
+        stale.save()
+        self.assert_counters(1, 1)
+        self.assertEqual(self.post.title, 'Edited')
+
+    def test_recount_repairs_the_counters(self):
+        self.post.comments.create(name='Ann', email='ann@example.com', body='Nice.')
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7, active_comment_count=7)
+        out = io.StringIO()
+        call_command('recount_comments', stdout=out)
+        self.assertIn('Recounted the comments of 1 posts.', out.getvalue())
+        self.assert_counters(1, 1)
+
+
+# The tag index follows tags and statuses through on_commit callbacks, so these tests
+# - run in real transactions.
+class TagIndexTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        author = User.objects.create_user('author')
+        self.posts = []
+        for i in range(5):
+            post = Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body='Body.', status='published')
+            post.tags.add('django')
+            self.posts.append(post)
+        # Two posts share the newest publish date; the id breaks the tie.
+        Post.objects.filter(pk__in=[self.posts[3].pk, self.posts[4].pk]).update(publish=self.posts[4].publish)
+        tag_index.rebuild()
+        self.tag = Tag.objects.get(slug='django')
+
+    def paginator(self):
+        listing = Post.published.all()
+        return TagIndexPaginator(listing.filter(tags__in=[self.tag]), 2, self.tag.pk, tag_index, listing)
+
+    def titles(self, page):
+        return [post.title for post in page]
+
+    def test_pages_match_the_database_order(self):
+        self.assertTrue(tag_index.warm)
+        expected = list(Post.published.filter(tags__in=[self.tag]).order_by('-publish', '-pk').values_list('title', flat=True))
+        paginator = self.paginator()
+        # The index picks the ids; only the posts themselves are fetched.
+        with CaptureQueriesContext(connection) as queries:
+            page = paginator.page()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('taggit_taggeditem', queries[0]['sql'])
+        pages = [self.titles(page)]
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append(self.titles(page))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(self.titles(paginator.page(page.previous_cursor)), pages[-2])
+
+    def test_index_follows_tags_and_statuses(self):
+        post = self.posts[0]
+        post.tags.add('orm')
+        orm = Tag.objects.get(slug='orm')
+        self.assertEqual(tag_index.tag_count(orm.pk), 1)
+        post.status = 'draft'
+        post.save()
+        self.assertEqual((tag_index.tag_count(self.tag.pk), tag_index.tag_count(orm.pk)), (4, 0))
+        post.status = 'published'
+        post.save()
+        self.assertEqual(tag_index.tag_count(self.tag.pk), 5)
+        post.tags.remove(self.tag)
+        self.posts[1].delete()
+        self.assertEqual(tag_index.tag_count(self.tag.pk), 3)
+        self.assertNotIn(post.pk, tag_index.tag_range(self.tag.pk, 0, 10))
+        orm.delete()
+        self.assertEqual(tag_index.tag_count(orm.pk), 0)
+        self.assertTrue(tag_index.warm)
+
+    def test_similar_posts_are_ranked_from_the_index(self):
+        for post in self.posts[:3]:
+            post.tags.add('orm')
+        first, second, third, fourth, fifth = self.posts
+        # Shared tags first, then the newest post; the id breaks the publish tie.
+        self.assertEqual(
+            tag_index.similar_posts(first.pk, 4), [(third.pk, 2), (second.pk, 2), (fifth.pk, 1), (fourth.pk, 1)],
+        )
+        self.assertEqual(tag_index.similar_posts(first.pk, 1), [(third.pk, 2)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(first.get_absolute_url())
+        self.assertEqual(
+            [post.title for post in response.context['similar_posts']], ['Post 2', 'Post 1', 'Post 4', 'Post 3'],
+        )
+        self.assertFalse(any(
+            'blog_similarpost' in query['sql'] or 'taggit_taggeditem' in query['sql'] for query in queries
+        ))
+
+
+# The built-in BM25 backend searches on SQLite. The index follows the posts through
+# - on_commit callbacks, so these tests run in real transactions.
+@override_settings(
+    BLOG_SEARCH_BACKEND='blog.search.bm25.BM25Backend', BLOG_SEARCH_RESULTS_PER_PAGE=10, BLOG_TAG_INDEX=False,
+)
+class BM25SearchTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        bm25_index.rebuild()
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, title, body, status='published'):
+        return Post.objects.create(
+            title=title, slug=title.lower().replace(' ', '-'), author=self.author, body=body, status=status,
+        )
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('blog:post_search'), {'query': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_results_are_ranked_and_paginated(self):
+        for i in range(15):
+            self.create_post(f'Post {i}', 'About caching. ' + 'More text here. ' * i)
+        self.create_post('Caching in Django', 'Caching of views and caching of templates.')
+        response = self.search('caching')
+        results = response.context['results']
+        self.assertEqual(response.context['total_results'], 16)
+        self.assertEqual(results[0].title, 'Caching in Django')
+        self.assertEqual(
+            results[0].snippet, '<mark>Caching</mark> of views and <mark>caching</mark> of templates.',
+        )
+        self.assertEqual(len(results), 10)
+        response = self.search('caching', cursor=results.next_cursor)
+        self.assertEqual(len(response.context['results']), 6)
+        pks = {post.pk for post in results} | {post.pk for post in response.context['results']}
+        self.assertEqual(len(pks), 16)
+
+    def test_only_the_posts_of_the_page_get_snippets(self):
+        for i in range(12):
+            self.create_post(f'Post {i}', 'About caching.')
+        first = self.search('caching').context['results']
+        with patch('blog.search.base.body_heads', wraps=body_heads) as heads:
+            second = self.search('caching', cursor=first.next_cursor).context['results']
+        self.assertEqual(len(second), 2)
+        heads.assert_called_once()
+        pks = set(heads.call_args[0][0])
+        self.assertEqual(pks, {post.pk for post in second})
+        self.assertTrue(pks.isdisjoint(post.pk for post in first))
+        self.assertEqual([post.snippet for post in second], ['About <mark>caching</mark>.'] * 2)
+
+    @override_settings(BLOG_SEARCH_SNIPPETS={'MAX_CHARS': 200})
+    def test_snippets_only_read_the_head_of_long_bodies(self):
+        self.create_post('Caching', 'Some words first. ' * 20 + 'Caching comes last.')
+        snippet = self.search('caching').context['results'][0].snippet
+        self.assertTrue(snippet.startswith('Some words first.'))
+        self.assertNotIn('<mark>', snippet)
+        self.assertNotIn('last', snippet)
+
+    def test_index_follows_publishing(self):
+        post = self.create_post('Signals', 'Using django signals.', status='draft')
+        self.assertEqual(self.search('signals').context['total_results'], 0)
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self.search('signals').context['total_results'], 1)
+        post.delete()
+        self.assertEqual(self.search('signals').context['total_results'], 0)
+
+    def test_facets_count_and_filter_the_matches(self):
+        for i, (year, tags) in enumerate([(2019, ['django']), (2020, ['django', 'orm']), (2020, ['orm'])]):
+            post = self.create_post(f'Queries {i}', 'Fast queries.')
+            post.publish = post.publish.replace(year=year)
+            post.save()
+            post.tags.add(*tags)
+        facets = self.search('queries').context['facets']
+        self.assertEqual(facets['tags'], [
+            {'name': 'django', 'slug': 'django', 'count': 2}, {'name': 'orm', 'slug': 'orm', 'count': 2},
+        ])
+        self.assertEqual(facets['years'], [{'year': 2020, 'count': 2}, {'year': 2019, 'count': 1}])
+        response = self.search('queries', tag='orm', year=2020)
+        self.assertEqual(response.context['total_results'], 2)
+        self.assertEqual(response.context['facets']['years'], [{'year': 2020, 'count': 2}])
+
+    @override_settings(BLOG_SEARCH_MAX_RESULTS=5)
+    def test_filters_and_facets_cover_matches_below_the_cap(self):
+        for i in range(8):
+            self.create_post(f'Queries {i}', 'Queries, queries and more queries.')
+        for i in range(2):
+            post = self.create_post(f'Old {i}', 'One query among many other words. ' * 20)
+            post.publish = post.publish.replace(year=2015)
+            post.save()
+            post.tags.add('orm')
+        response = self.search('queries')
+        self.assertTrue(response.context['more_results'])
+        self.assertNotIn('Old 0', [post.title for post in response.context['results']])
+        facets = response.context['facets']
+        self.assertEqual(facets['tags'], [{'name': 'orm', 'slug': 'orm', 'count': 2}])
+        self.assertEqual(facets['years'][-1], {'year': 2015, 'count': 2})
+        self.assertEqual(sum(facet['count'] for facet in facets['years']), 10)
+        for params in ({'tag': 'orm'}, {'year': 2015}):
+            response = self.search('queries', **params)
+            self.assertEqual(response.context['total_results'], 2)
+            self.assertFalse(response.context['more_results'])
+            self.assertEqual({post.title for post in response.context['results']}, {'Old 0', 'Old 1'})
+
+    def test_unchanged_results_are_not_built_again(self):
+        self.create_post('Caching', 'Cache everything.')
+        etag = self.search('cache')['ETag']
+        response = self.client.get(reverse('blog:post_search'), {'query': 'cache'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.create_post('More caching', 'Cache more.')
+        self.assertNotEqual(self.search('cache')['ETag'], etag)
+
+    def test_misspelled_query_gets_a_suggestion(self):
+        self.create_post('Python tips', 'Write better python.')
+        response = self.search('pyhton')
+        self.assertEqual(response.context['suggestion'], 'python')
+        self.assertEqual([post.title for post in response.context['results']], ['Python tips'])
+
+
+# The PostgreSQL backend searches the stored search vectors, which a trigger keeps
+# - in step with the titles and bodies, and falls back to trigram similarity (pg_trgm).
+@skipUnless(connection.vendor == 'postgresql', 'The search vector and pg_trgm only exist on PostgreSQL.')
+@override_settings(BLOG_SEARCH_BACKEND='blog.search.postgres.PostgresBackend', BLOG_TAG_INDEX=False)
+class PostgresSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        result_cache().clear()
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, title, body, status='published'):
+        return Post.objects.create(
+            title=title, slug=title.lower().replace(' ', '-'), author=self.author, body=body, status=status,
+        )
+
+    def matches(self, query):
+        return list(Post.objects.filter(search_vector=SearchQuery(query)).values_list('title', flat=True))
+
+    def test_trigger_keeps_the_search_vector_in_step(self):
+        post = self.create_post('Indexes', 'Use a covering index.')
+        self.assertEqual(self.matches('indexes'), ['Indexes'])
+        self.assertEqual(self.matches('covering'), ['Indexes'])
+        post.title = 'Partitioning'
+        post.body = 'Split the big tables.'
+        post.save()
+        self.assertEqual(self.matches('covering'), [])
+        self.assertEqual(self.matches('tables'), ['Partitioning'])
+        # Bulk updates go through the trigger as well.
+        Post.objects.filter(pk=post.pk).update(body='Vacuum often.')
+        self.assertEqual(self.matches('vacuum'), ['Partitioning'])
+
+    def test_titles_rank_above_bodies(self):
+        self.create_post('Replication', 'Streaming replication.')
+        self.create_post('Backups', 'Test the replication of your backups.')
+        self.create_post('Draft replication', 'Replication.', status='draft')
+        titles = [post.title for post in search_posts('replication')]
+        self.assertEqual(titles[:1], ['Replication'])
+        self.assertNotIn('Draft replication', titles)
+
+    @override_settings(BLOG_SEARCH_SNIPPETS={'MAX_CHARS': 200})
+    def test_headlines_only_read_the_head_of_long_bodies(self):
+        self.create_post('Caching', 'Some words first. ' * 20 + 'Caching comes last.')
+        response = self.client.get(reverse('blog:post_search'), {'query': 'caching'})
+        snippet = response.context['results'][0].snippet
+        self.assertIn('Some words first.', snippet)
+        self.assertNotIn('<mark>', snippet)
+
+    def test_misspellings_fall_back_to_trigram_similarity(self):
+        django = self.create_post('Django', 'Web framework.')
+        self.create_post('Flask', 'Micro framework.')
+        notes = self.create_post('Notes', 'Nothing here.')
+        notes.tags.add('postgresql')
+        self.assertEqual([post.title for post in fuzzy_search_posts('djngo')], ['Django'])
+        self.assertEqual([post.title for post in fuzzy_search_posts('postgersql')], ['Notes'])
+        build_vocabulary()
+        response = self.client.get(reverse('blog:post_search'), {'query': 'djngo'})
+        self.assertTrue(response.context['fuzzy'])
+        self.assertEqual(response.context['suggestion'], 'django')
+        self.assertEqual(list(response.context['results']), [django])
+
+    def test_exact_matches_do_not_fall_back(self):
+        self.create_post('Django', 'Web framework.')
+        build_vocabulary()
+        response = self.client.get(reverse('blog:post_search'), {'query': 'django'})
+        self.assertFalse(response.context['fuzzy'])
+        self.assertIsNone(response.context['suggestion'])
+
+
+# Records the queries it is asked, and takes `delay` seconds to answer them.
+class RecordingBackend(SearchBackend):
+    def __init__(self):
+        self.queries = []
+        self.delay = 0
+
+    def search(self, query, limit, tag=None, year=None):
+        self.queries.append(query)
+        time.sleep(self.delay)
+        return [(len(self.queries), 1.0)]
+
+
+# Ranked hits are cached per process by case folded query and search generation.
+@override_settings(BLOG_SEARCH_BACKEND='blog.tests.RecordingBackend', BLOG_TAG_INDEX=False)
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        result_cache().clear()
+        self.backend = get_backend()
+        self.backend.queries, self.backend.delay = [], 0
+
+    def test_queries_are_cached_as_typed(self):
+        self.assertEqual(search_hits('Speed'), search_hits('  speed '))
+        # The backend stems the query itself; "news" and "new" are different searches.
+        self.assertNotEqual(search_hits('news'), search_hits('new'))
+        self.assertEqual(self.backend.queries, ['Speed', 'news', 'new'])
+
+    def test_results_are_dropped_with_the_generation(self):
+        search_hits('django')
+        bump_generation(SEARCH_GENERATION)
+        search_hits('django')
+        self.assertEqual(self.backend.queries, ['django', 'django'])
+
+    def test_concurrent_misses_search_once(self):
+        self.backend.delay = 0.1
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: search_hits('stampede'), range(4)))
+        self.assertEqual(self.backend.queries, ['stampede'])
+        self.assertEqual(results, [results[0]] * 4)
+
+
+@override_settings(BLOG_TAG_INDEX=False)
+class AutocompleteTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.rebuild()
+        author = User.objects.create_user('author')
+        for title, status, comments in [
+            ('Django tips', 'published', 1),
+            ('Django signals', 'published', 5),
+            ('Django drafts', 'draft', 9),
+        ]:
+            Post.objects.create(
+                title=title, slug=title.lower().replace(' ', '-'), author=author, body='Body.',
+                status=status, comment_count=comments,
+            )
+
+    def suggestions(self, prefix):
+        response = self.client.get(reverse('blog:post_autocomplete'), {'q': prefix})
+        self.assertEqual(response.status_code, 200)
+        return [suggestion['label'] for suggestion in response.json()['suggestions']]
+
+    def test_published_titles_by_popularity(self):
+        self.assertEqual(self.suggestions('dj'), ['Django signals', 'Django tips'])
+        self.assertEqual(self.suggestions('sig'), ['Django signals'])
+        self.assertEqual(self.suggestions('d'), [])
+
+    def test_index_follows_publishing(self):
+        post = Post.objects.get(title='Django drafts')
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self.suggestions('django'), ['Django drafts', 'Django signals', 'Django tips'])
+        post.delete()
+        self.assertEqual(self.suggestions('django'), ['Django signals', 'Django tips'])
+
+
+# The sidebar fragment is cached until a change to the published posts or the comments
+# - bumps its generation. The bumps run on commit, so these tests use real transactions.
+@override_settings(BLOG_TAG_INDEX=False)
+class SidebarCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        author = User.objects.create_user('author')
+        self.older = Post.objects.create(
+            title='Older', slug='older', author=author, body='Body.', status='published',
+            publish=timezone.now() - timedelta(days=1),
+        )
+        self.newer = Post.objects.create(title='Newer', slug='newer', author=author, body='Body.', status='published')
+        self.draft = Post.objects.create(title='Draft', slug='draft', author=author, body='Body.', status='draft')
+        self.comment = self.newer.comments.create(name='Reader', email='reader@example.com', body='Nice.')
+
+    def sidebar(self):
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().split('<div id="sidebar">')[1]
+
+    def most_commented(self):
+        return self.sidebar().split('Most commented posts')[1]
+
+    # Run the change and return whether the sidebar generation was bumped.
+    def bumps(self, change):
+        generation = get_generation(SIDEBAR_GENERATION)
+        change()
+        return get_generation(SIDEBAR_GENERATION) != generation
+
+    def test_publishing_and_unpublishing_change_the_sidebar(self):
+        self.assertNotIn('Draft', self.sidebar())
+        self.draft.status = 'published'
+        self.assertTrue(self.bumps(self.draft.save))
+        self.assertIn('Draft', self.sidebar())
+        self.draft.status = 'draft'
+        self.assertTrue(self.bumps(self.draft.save))
+        self.assertNotIn('Draft', self.sidebar())
+
+    def test_renaming_and_deleting_a_published_post_change_the_sidebar(self):
+        self.assertIn('Newer', self.sidebar())
+        self.newer.title = 'Renamed'
+        self.assertTrue(self.bumps(self.newer.save))
+        sidebar = self.sidebar()
+        self.assertIn('Renamed', sidebar)
+        self.assertNotIn('Newer', sidebar)
+        self.assertTrue(self.bumps(self.newer.delete))
+        self.assertNotIn('Renamed', self.sidebar())
+
+    def test_comments_change_the_most_commented_posts(self):
+        sidebar = self.most_commented()
+        self.assertLess(sidebar.index('Newer'), sidebar.index('Older'))
+
+        def comment_twice():
+            for i in range(2):
+                self.older.comments.create(name='Reader', email='reader@example.com', body=f'Comment {i}.')
+
+        self.assertTrue(self.bumps(comment_twice))
+        sidebar = self.most_commented()
+        self.assertLess(sidebar.index('Older'), sidebar.index('Newer'))
+        # Moderation bumps the generation too; the ranking counts every comment, so
+        # - the sidebar reads the same.
+        self.comment.active = False
+        self.assertTrue(self.bumps(self.comment.save))
+        self.assertEqual(self.most_commented(), sidebar)
+
+    def test_editing_a_draft_keeps_the_cached_sidebar(self):
+        sidebar = self.sidebar()
+        self.draft.title = 'Still a draft'
+        self.draft.body = 'Edited.'
+        self.assertFalse(self.bumps(self.draft.save))
+        with self.assertNumQueries(2):
+            self.assertEqual(self.sidebar(), sidebar)
+
+
+# The feed is rendered once per change to the published posts and revalidated
+# - from the cache alone.
+@override_settings(BLOG_TAG_INDEX=False)
+class FeedTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        # Requests warm the in-memory indexes; build them here instead of in the background.
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(
+            title='Feeds', slug='feeds', author=author, body='Polled all day.', status='published',
+        )
+
+    def test_conditional_requests_do_not_query_the_database(self):
+        url = reverse('blog:post_feed')
+        response = self.client.get(url)
+        self.assertContains(response, 'Polled all day.')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertFalse(etag.startswith('W/'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.post.body = 'Edited.'
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Edited.')
+
+    def test_tag_and_atom_feeds_share_the_rendered_items(self):
+        self.post.tags.add('django')
+        other = Post.objects.create(
+            title='Other', slug='other', author=self.post.author, body='Untagged.', status='published',
+        )
+        self.assertContains(self.client.get(reverse('blog:post_feed')), 'Untagged.')
+        response = self.client.get(reverse('blog:post_atom_feed_by_tag', args=['django']))
+        self.assertEqual(response['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertContains(response, 'Polled all day.')
+        self.assertNotContains(response, 'Untagged.')
+        other.tags.add('django')
+        # Both items are cached already: only the ids, the last update and the tag are queried.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('blog:post_feed_by_tag', args=['django']))
+        self.assertContains(response, 'Untagged.')
+        self.assertEqual(self.client.get(reverse('blog:post_feed_by_tag', args=['nope'])).status_code, 404)
+
+
+# Sitemap sections are fixed ranges of post ids, written again only when their posts change.
+@override_settings(BLOG_TAG_INDEX=False)
+class SitemapTests(TestCase):
+    def setUp(self):
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        sitemap = override_settings(BLOG_SITEMAP={'ROOT': root.name, 'SECTION_SIZE': 2, 'PROTOCOL': 'https'})
+        sitemap.enable()
+        self.addCleanup(sitemap.disable)
+        author = User.objects.create_user('author')
+        self.posts = [
+            Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body='Body.', status='published')
+            for i in range(5)
+        ]
+
+    def test_only_changed_sections_are_written_again(self):
+        self.assertEqual(len(build_sitemaps()), 3)
+        self.assertEqual(build_sitemaps(), [])
+        post = self.posts[4]
+        post.title = 'Edited'
+        post.save()
+        self.assertEqual(build_sitemaps(), [post.pk // 2])
+
+    def test_index_and_sections_are_served_gzipped(self):
+        response = self.client.get('/sitemap.xml', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        index = gzip.decompress(response.content).decode()
+        self.assertEqual(index.count('<sitemap>'), 3)
+        post = self.posts[0]
+        response = self.client.get(f'/sitemap-posts-{post.pk // 2}.xml')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertContains(response, f'<loc>https://example.com{post.get_absolute_url()}</loc>')
+        self.assertEqual(self.client.get('/sitemap-posts-99.xml').status_code, 404)
+
+    def test_gzip_is_only_sent_to_clients_accepting_it(self):
+        build_sitemaps()
+        for accept_encoding, gzipped in [
+            ('gzip', True), ('deflate, gzip;q=0.5', True), ('x-gzip', True), ('*', True),
+            ('gzip;q=0', False), ('gzip;q=0, *', False), ('identity', False), ('*;q=0', False), ('', False),
+        ]:
+            response = self.client.get('/sitemap.xml', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(response.get('Content-Encoding') == 'gzip', gzipped, accept_encoding)
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            content = gzip.decompress(response.content) if gzipped else response.content
+            self.assertIn(b'<sitemapindex', content)
+
+
+# Rejects the emails sent to one address, like a server refusing a recipient.
+class RejectingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        if any('rejected@example.com' in message.to for message in messages):
+            raise OSError('Recipient refused')
+        return super().send_messages(messages)
+
+
+# Simulates another worker taking over bob's message while this worker's batch is sent.
+class StealingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        OutboxMessage.objects.filter(recipients='bob@example.com').update(
+            claim='other-worker', next_attempt=timezone.now() + timedelta(minutes=5),
+        )
+        return super().send_messages(messages)
+
+
+# post_share only queues the email; the outbox worker sends it.
+@override_settings(BLOG_TAG_INDEX=False, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(TestCase):
+    def setUp(self):
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='Mail', slug='mail', author=author, body='Body.', status='published')
+
+    def share(self, to):
+        response = self.client.post(
+            reverse('blog:post_share', args=[self.post.pk]), {'name': 'Ann', 'email': 'ann@example.com', 'to': to},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_shares_are_queued_and_sent_by_the_worker(self):
+        self.share('bob@example.com')
+        self.share('eve@example.com')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(drain_outbox(workers=1), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['bob@example.com', 'eve@example.com'])
+        self.assertEqual(drain_outbox(workers=1), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='blog.tests.RejectingEmailBackend')
+    def test_failures_are_retried_with_a_backoff(self):
+        self.share('rejected@example.com')
+        self.share('bob@example.com')
+        self.assertEqual(drain_outbox(workers=1), (1, 1))
+        failed = OutboxMessage.objects.get(recipients='rejected@example.com')
+        self.assertEqual((failed.status, failed.attempts), ('queued', 1))
+        self.assertIn('Recipient refused', failed.last_error)
+        # Not due again before the backoff is over.
+        self.assertEqual(drain_outbox(workers=1), (0, 0))
+        OutboxMessage.objects.filter(pk=failed.pk).update(next_attempt=failed.created, attempts=4)
+        self.assertEqual(drain_outbox(workers=1), (0, 1))
+        self.assertEqual(OutboxMessage.objects.get(pk=failed.pk).status, 'failed')
+
+
+    def test_a_worker_that_died_is_counted_as_an_attempt(self):
+        self.share('bob@example.com')
+        message = OutboxMessage.objects.get()
+        self.assertEqual([m.attempts for m in claim(10)], [1])
+        # The worker died: its lease runs out and the message is claimed again.
+        OutboxMessage.objects.update(next_attempt=message.created)
+        self.assertEqual([m.attempts for m in claim(10)], [2])
+        OutboxMessage.objects.update(next_attempt=message.created, attempts=5)
+        self.assertEqual(claim(10), [])
+        self.assertEqual(OutboxMessage.objects.get().status, 'failed')
+
+    @override_settings(EMAIL_BACKEND='blog.tests.StealingEmailBackend', BLOG_OUTBOX={'LEASE': 0})
+    def test_messages_taken_over_after_the_lease_are_not_sent_twice(self):
+        self.share('ann@example.com')
+        self.share('bob@example.com')
+        self.assertEqual(drain_outbox(workers=1), (1, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['ann@example.com']])
+        taken = OutboxMessage.objects.get(recipients='bob@example.com')
+        self.assertEqual((taken.status, taken.claim), ('sending', 'other-worker'))
+
+
+# The digest is rendered once per format and sent in chunks from a thread pool.
+@override_settings(BLOG_TAG_INDEX=False, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class DigestTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user('author')
+        Post.objects.create(title='New & shiny', slug='new', author=author, body='Fresh.', status='published')
+        for i, (variant, active) in enumerate([('html', True), ('text', True), ('html', False), ('text', True)]):
+            Subscriber.objects.create(email=f'reader{i}@example.com', format=variant, active=active)
+
+    def test_digest_goes_to_active_subscribers_once(self):
+        run, sent, _ = send_digest(workers=2, chunk_size=2)
+        self.assertEqual(sent, 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'reader0@example.com', 'reader1@example.com', 'reader3@example.com',
+        ])
+        html = next(message for message in mail.outbox if message.to == ['reader0@example.com'])
+        self.assertIn('New & shiny', html.body)
+        self.assertIn('New &amp; shiny', html.alternatives[0][0])
+        run.refresh_from_db()
+        self.assertIsNotNone(run.finished)
+        # The next run only covers the posts published since.
+        self.assertEqual(send_digest()[1], 0)
+
+    @override_settings(EMAIL_BACKEND='blog.tests.RejectingEmailBackend')
+    def test_refused_recipients_do_not_stop_the_run(self):
+        rejected = Subscriber.objects.create(email='rejected@example.com', format='text')
+        Subscriber.objects.create(email='reader4@example.com', format='html')
+        run, sent, _ = send_digest(workers=1, chunk_size=10)
+        self.assertEqual(sent, 4)
+        self.assertIn(['reader4@example.com'], [message.to for message in mail.outbox])
+        run.refresh_from_db()
+        self.assertEqual((run.sent, run.failed), (4, 1))
+        self.assertGreater(run.last_subscriber, rejected.pk)
+        self.assertIsNotNone(run.finished)
+
+    def test_unfinished_run_resumes_after_its_checkpoint(self):
+        last = Subscriber.objects.get(email='reader1@example.com')
+        DigestRun.objects.create(since=last.created.replace(year=2000), until=last.created, last_subscriber=last.pk)
+        Post.objects.update(publish=last.created)
+        send_digest(workers=1)
+        self.assertEqual([message.to for message in mail.outbox], [['reader3@example.com']])
+
+
+# The changelists join their foreign keys in, so their query counts don't grow with the rows.
+@override_settings(BLOG_TAG_INDEX=False)
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        for i in range(6):
+            author = User.objects.create_user(f'author-{i}')
+            post = Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, body='Body.')
+            post.comments.create(name='Ann', email='ann@example.com', body='Nice.')
+
+    def setUp(self):
+        autocomplete_index.rebuild()
+        bm25_index.rebuild()
+        self.client.force_login(self.admin)
+
+    def count_queries(self, model_admin, url, per_page):
+        model_admin.list_per_page = per_page
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        finally:
+            del model_admin.list_per_page
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), per_page)
+        return len(queries)
+
+    def test_query_counts_do_not_grow_with_the_rows(self):
+        for model_admin, url in [
+            (PostAdmin, reverse('admin:blog_post_changelist')),
+            (CommentAdmin, reverse('admin:blog_comment_changelist')),
+        ]:
+            self.assertEqual(self.count_queries(model_admin, url, 2), self.count_queries(model_admin, url, 6))
+
+    def test_autocomplete_filters(self):
+        post = Post.objects.get(title='Post 3')
+        response = self.client.get(reverse('admin:blog_post_changelist'), {'author__id__exact': post.author_id})
+        self.assertEqual([row.title for row in response.context['cl'].result_list], ['Post 3'])
+        self.assertContains(response, reverse('admin:auth_user_autocomplete'))
+        response = self.client.get(reverse('admin:blog_comment_changelist'), {'post__id__exact': post.pk})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_small_results_are_counted_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(EstimatedCountPaginator(Post.objects.all(), 2).count, 6)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Comments are searched by full-text search on PostgreSQL only.')
+    def test_comments_are_found_by_email_address(self):
+        Comment.objects.filter(post__title='Post 2').update(email='bob@example.com', name='Bob')
+        response = self.client.get(reverse('admin:blog_comment_changelist'), {'q': 'Bob@Example.com'})
+        self.assertEqual([comment.name for comment in response.context['cl'].result_list], ['Bob'])
+        response = self.client.get(reverse('admin:blog_comment_changelist'), {'q': 'bo'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+# Bulk moderation changes rows with set-based statements and keeps the denormalized
+# - data in step once per batch. It runs in real transactions for the index updates.
+class BulkModerationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        tag_index.rebuild()
+        bm25_index.rebuild()
+        autocomplete_index.rebuild()
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, title, tags, status='published'):
+        post = Post.objects.create(title=title, slug=title.lower(), author=self.author, body=f'{title} body.', status=status)
+        post.tags.add(*tags)
+        return post
+
+    def assert_comment_counters(self):
+        for post in Post.objects.all():
+            self.assertEqual(post.comment_count, post.comments.count())
+            self.assertEqual(post.active_comment_count, post.comments.filter(active=True).count())
+
+    def test_comment_moderation(self):
+        posts = [self.create_post(f'Post{i}', ['django']) for i in range(2)]
+        for i in range(12):
+            posts[i % 2].comments.create(name='Spam', email=f'spam{i % 3}@example.com', body='Buy now.')
+        # One batch: the ids, lock, update, counters, and the check for a next batch.
+        with self.assertNumQueries(6):
+            self.assertEqual(set_comments_active(Comment.objects.all(), False, batch_size=100), 12)
+        self.assert_comment_counters()
+        self.assertEqual(set_comments_active(Comment.objects.filter(email='spam0@example.com'), True), 4)
+        self.assert_comment_counters()
+        out = io.StringIO()
+        call_command('moderate_comments', 'delete', '--email', 'SPAM1@example.com', '--batch-size', '3', stdout=out)
+        self.assertIn('Deleted 4 comments.', out.getvalue())
+        self.assertEqual(Comment.objects.count(), 8)
+        self.assert_comment_counters()
+
+    def test_bulk_publishing(self):
+        published = self.create_post('Published', ['django', 'orm'])
+        drafts = [self.create_post(f'Draft{i}', ['django'] + (['orm'] if i else []), 'draft') for i in range(3)]
+        self.assertEqual(set_posts_status(Post.objects.filter(status='draft'), 'published', batch_size=2), 3)
+        self.assertEqual(counters.get_count(counters.status_key('published')), 4)
+        django_tag = published.tags.get(name='django')
+        self.assertEqual(counters.get_count(counters.tag_key(django_tag.pk)), 4)
+        self.assertEqual(tag_index.tag_count(django_tag.pk), 4)
+        self.assertEqual(len(bm25_index.search('draft1', 10)), 1)
+        stored = set(SimilarPost.objects.values_list('post_id', 'similar_id', 'score'))
+        for post in Post.objects.all():
+            rebuild_similar_posts(post)
+        self.assertEqual(set(SimilarPost.objects.values_list('post_id', 'similar_id', 'score')), stored)
+
+        self.assertEqual(set_posts_status(Post.objects.filter(pk__in=[d.pk for d in drafts]), 'draft'), 3)
+        self.assertEqual(counters.get_count(counters.status_key('published')), 1)
+        self.assertEqual(counters.get_count(counters.tag_key(django_tag.pk)), 1)
+        self.assertEqual(tag_index.tag_count(django_tag.pk), 1)
+        self.assertEqual(bm25_index.search('draft1', 10), [])
+        self.assertFalse(SimilarPost.objects.filter(similar__in=drafts).exists())
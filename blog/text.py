@@ -0,0 +1,57 @@
+import re
+
+# Words too common to tell posts apart. They are dropped from search queries, so
+# - "the django orm" and "Django ORM" are the same search.
+STOP_WORDS = frozenset('''
+    a about above after again against all am an and any are as at be because been before being
+    below between both but by can did do does doing down during each few for from further had
+    has have having he her here hers herself him himself his how i if in into is it its itself
+    just me more most my myself no nor not now of off on once only or other our ours ourselves
+    out over own same she should so some such than that the their theirs them themselves then
+    there these they this those through to too under until up very was we were what when where
+    which while who whom why will with you your yours yourself yourselves
+'''.split())
+
+
+VOWELS = frozenset('aeiouy')
+
+
+# Case folded words of a text.
+def words(text):
+    return re.findall(r'\w+', text.casefold())
+
+
+# A light suffix stripping stemmer, so plurals and the common verb forms of a
+# - word share one term ("posts", "posted", "posting" -> "post"). It's much
+# - cruder than PostgreSQL's snowball stemmer but cheap and predictable.
+def stem(word):
+    if len(word) <= 3:
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    for suffix in ('ing', 'ed'):
+        base = word[:-len(suffix)]
+        # The stem has to keep a vowel ("string", "spring") and "eed" stays ("speed").
+        if word.endswith(suffix) and len(base) >= 3 and VOWELS.intersection(base) and not word.endswith('eed'):
+            word = base
+            # "running" -> "run", "stopped" -> "stop"
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'lsz':
+                word = word[:-1]
+            return word
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+# Search terms of a text: case folded, stop words removed, stemmed.
+def terms(text):
+    return [stem(word) for word in words(text) if word not in STOP_WORDS]
+
+
+# Canonical form of a search query, used as a cache key: case folded, with its
+# - whitespace collapsed. It isn't stemmed or reordered, since the backends don't
+# - stem like stem() does ("news" and "new" are different PostgreSQL searches).
+def normalize_query(query):
+    return ' '.join(query.casefold().split())
@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .feeds import LatestPostFeed
+from .feeds import LatestPostAtomFeed, LatestPostFeed, TagPostAtomFeed, TagPostFeed
 
 # Define app namespace
 #  - You will refer to your blog URLs easily by using the namespace
@@ -16,5 +16,9 @@ urlpatterns = [
     path('<int:post_id>/share/', views.post_share, name='post_share'),
     path('tag/<slug:tag_slug>/', views.post_list, name='post_list_by_tag'),
     path('feed/', LatestPostFeed(), name='post_feed'),
+    path('feed/atom/', LatestPostAtomFeed(), name='post_atom_feed'),
+    path('tag/<slug:tag_slug>/feed/', TagPostFeed(), name='post_feed_by_tag'),
+    path('tag/<slug:tag_slug>/feed/atom/', TagPostAtomFeed(), name='post_atom_feed_by_tag'),
     path('search/', views.post_search, name='post_search'),
+    path('search/autocomplete/', views.post_autocomplete, name='post_autocomplete'),
 ]
@@ -1,19 +1,45 @@
-from django.core.mail import send_mail
+import gzip
+import hashlib
+import os
+
+from django.conf import settings
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
-from django.contrib.postgres.search import TrigramSimilarity
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, urlencode
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 from taggit.models import Tag
 
 from .forms import EmailPostForm, CommentForm, SearchForm
-from .models import Post
+from .models import Post, defer_body
+from .autocomplete import suggest
+from .cache import SEARCH_GENERATION, SIDEBAR_GENERATION, get_generation
+from .counters import status_key
+from .outbox import enqueue
+from .pagination import (
+    CountedPaginator, InvalidCursor, KeysetPaginator, TagIndexPaginator, TagIndexPostList,
+)
+from .search import (
+    SearchPaginator, add_snippets, fuzzy_search_hits, max_search_results, search_facets, search_hits,
+    suggest_query,
+)
+from .sitemaps import INDEX_FILE, build_sitemaps, section_file, sitemap_path
+from .tag_index import tag_index
 
 
 # List posts view
 def post_list(request, tag_slug=None):
-    object_list = Post.published.all()
+    # The list template shows the author and the tags of every post, so fetch the
+    # - authors in the same query and all the tags of a page in one extra query.
+    # - Only the pre-rendered excerpt is shown, so the full bodies are not loaded (but for
+    # - the posts whose excerpt has to be rendered again, see defer_body()).
+    listing = defer_body(
+        Post.published.select_related('author').prefetch_related('tags').defer('body_html', 'search_vector')
+    )
+    object_list = listing
     # Start tag with default value of None.
     tag = None
     # If there is a given tag slug, you get the Tag object with the given slug.
@@ -21,25 +47,44 @@ def post_list(request, tag_slug=None):
         tag = get_object_or_404(Tag, slug=tag_slug)
         # Filter the posts by the ones that contain the given tag.
         object_list = object_list.filter(tags__in=[tag])
-    # Instantiate the Paginator class with the number of
-    # objects that you want to display on each page.
-    paginator = Paginator(object_list, 3)
+    per_page = getattr(settings, 'BLOG_POSTS_PER_PAGE', 3)
     # Get the page GET parameter, which indicates the
     # current page number.
     page = request.GET.get('page')
-    # Obtain the objects for the desired page by
-    # calling the page() method of Paginator.
-    try:
-        posts = paginator.page(page)
-    except PageNotAnInteger:
-        # If the page parameter is not an integer, you retrieve
-        # the first page of results.
-        posts = paginator.page(1)
-    except EmptyPage:
-        # If this parameter is a number higher than the last page
-        # of results, you retrieve the last page.
-        posts = paginator.page(paginator.num_pages)
-        # Pass the page number and retrieved objects to the template.
+    # In keyset mode the list is paginated with opaque ?cursor= tokens keyed on
+    # - (publish, id), so every page costs the same no matter how deep it is.
+    # - Tag pages pick their posts from the in-memory tag index while it is warm.
+    if getattr(settings, 'BLOG_PAGINATION', 'keyset') == 'keyset':
+        if tag:
+            paginator = TagIndexPaginator(object_list, per_page, tag.id, tag_index, listing)
+        else:
+            paginator = KeysetPaginator(object_list, per_page)
+        try:
+            posts = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor:
+            # If the cursor can't be decoded, you retrieve the first page.
+            posts = paginator.page()
+    else:
+        # Instantiate the Paginator class with the number of
+        # objects that you want to display on each page. Its total comes
+        # from the post counters (or the tag index), so num_pages doesn't scan the table.
+        if tag:
+            paginator = Paginator(TagIndexPostList(object_list, tag.id, tag_index, listing), per_page)
+        else:
+            paginator = CountedPaginator(object_list, per_page, count_key=status_key('published'))
+        # Obtain the objects for the desired page by
+        # calling the page() method of Paginator.
+        try:
+            posts = paginator.page(page)
+        except PageNotAnInteger:
+            # If the page parameter is not an integer, you retrieve
+            # the first page of results.
+            posts = paginator.page(1)
+        except EmptyPage:
+            # If this parameter is a number higher than the last page
+            # of results, you retrieve the last page.
+            posts = paginator.page(paginator.num_pages)
+    # Pass the page number and retrieved objects to the template.
     return render(
         request,
         'blog/post/list.html',
@@ -53,14 +98,13 @@ def post_list(request, tag_slug=None):
 
 # Detail post view
 def post_detail(request, year, month, day, post):
-    post = get_object_or_404(
-        Post,
-        slug=post,
-        status='published',
-        publish__year=year,
-        publish__month=month,
-        publish__day=day
-    )
+    # Look the post up by slug within the publish day, as an indexable datetime range.
+    try:
+        published_that_day = Post.published.on_date(year, month, day)
+    except (ValueError, OverflowError):
+        # The URL holds a date that doesn't exist, such as 2021/2/30.
+        raise Http404('No Post matches the given query.')
+    post = get_object_or_404(published_that_day.select_related('author'), slug=post)
     # List of active comments for this specific post.
     # QuerySet to retrieve all active comments for this post:
     comments = post.comments.filter(active=True)
@@ -80,22 +124,27 @@ def post_detail(request, year, month, day, post):
             new_comment.post = post
             # Now save the comment to the database
             new_comment.save()
+            # The counter was updated in the database; keep the loaded post in line.
+            post.comment_count += 1
+            post.active_comment_count += int(new_comment.active)
     else:
         comment_form = CommentForm()
 
-    # List of similar posts based off tags.
-    # Retrieve a Python list of IDs for the tags of the current post.
-    # - ass flat=True to it to get single values such as
-    # - [1, 2, 3, ...] instead of one-tuples such as [(1,), (2,), (3,) ...].
-    post_tags_ids = post.tags.values_list('id', flat=True)
-    # Get all posts that contain any of these tags, excluding the current post itself.
-    similar_posts = Post.published.filter(tags__in=post_tags_ids).exclude(id=post.id)
-    # Use the Count aggregation function to generate a calculated field —same_tags— that
-    # - contains the number of tags shared with all the tags queried.
-    # - order the result by the number of shared tags (descending order) and by publish
-    # - to display recent posts first for the posts with the same number of shared tags.
-    # You slice the result to retrieve only the first four posts.
-    similar_posts = similar_posts.annotate(same_tags=Count('tags')).order_by('-same_tags', '-publish')[:4]
+    # List of similar posts based off tags. They are precomputed in the SimilarPost
+    # - table (see blog/similarity.py), ordered by the number of shared tags and then
+    # - by publish to display recent posts first for posts with the same number of
+    # - shared tags, so this is a single indexed lookup. Slice the first four posts.
+    # Only the title and the URL of the similar posts are shown, so their bodies are not loaded.
+    # - While the in-memory tag index is warm it ranks them without SQL and only the
+    # - four winners are fetched by id.
+    ranked = tag_index.similar_posts(post.id, 4)
+    if ranked is None:
+        similar_posts = Post.objects.filter(similar_to__post=post).only(
+            'title', 'slug', 'publish'
+        ).order_by('-similar_to__score', '-similar_to__similar_publish')[:4]
+    else:
+        similar = Post.objects.only('title', 'slug', 'publish').in_bulk([pk for pk, score in ranked])
+        similar_posts = [similar[pk] for pk, score in ranked if pk in similar]
 
     return render(request,
                   'blog/post/detail.html', {
@@ -126,8 +175,10 @@ def post_share(request, post_id):
             subject = f"{cd['name']} recommends you read {post.title}"
             message = f"Read {post.title} at {post_url}\n\n" \
                       f"{cd['name']}\'s comments: {cd['comments']}"
-            # Send the email to the email address contained in the to field of the form
-            send_mail(subject, message, 'admin@myblog.com', [cd['to']])
+            # Queue the email to the email address contained in the to field of the form. The
+            # - outbox worker (`manage.py send_outbox`) sends it, so a slow mail server
+            # - never holds up the request.
+            enqueue(subject, message, 'admin@myblog.com', [cd['to']])
             sent = True
     else:
         form = EmailPostForm()
@@ -139,12 +190,31 @@ def post_share(request, post_id):
     })
 
 
+# ETag of a search page: the same URL gives the same page until the search results
+# - or the sidebar change, so browsers and proxies can revalidate it without it being
+# - built again.
+def search_etag(request):
+    if 'query' not in request.GET:
+        return None
+    generations = f'{get_generation(SEARCH_GENERATION)}:{get_generation(SIDEBAR_GENERATION)}'
+    return hashlib.sha1(f'{generations}:{request.get_full_path()}'.encode()).hexdigest()
+
+
 # 'Full Text' search form
+@condition(etag_func=search_etag)
+@cache_control(public=True, max_age=60)
 def post_search(request):
     # Instantiate the SearchForm form
     form = SearchForm()
     query = None
     results = []
+    total_results = None
+    more_results = False
+    fuzzy = False
+    suggestion = None
+    facets = None
+    tag = year = None
+    page_query = {}
 
     # To check whether the form is submitted, you look for the query parameter
     # - in the request.GET dictionary.
@@ -156,27 +226,54 @@ def post_search(request):
         # - verify that the form data is valid.
         if form.is_valid():
             query = form.cleaned_data['query']
-            #  If the form is valid, you search for published posts with a custom
-            #  - SearchVector instance built with the title and body fields.
-            # -- apply different weights to the search vectors built using the title and body fields
-            search_vector = SearchVector('title', weight='A') + SearchVector('body', weight='B')
-            # Create a SearchQuery object, filter results by it, and use SearchRank to
-            # - order the results by relevancy.
-            search_query = SearchQuery(query)
-            results = Post.published.annotate(
-                search=search_vector,
-                rank=SearchRank(search_vector, search_query)
-                # Filter the results to display only the ones with a rank higher than 0.3.
-            ).filter(rank__gte=0.3).order_by('-rank')
+            # If the form is valid, you search for published posts with the configured search
+            # - backend: PostgreSQL full-text search, where the title (weight A) and body (weight B)
+            # - search vector is stored on every post and GIN indexed and SearchRank orders the
+            # - matching results by relevancy, or the built-in BM25 engine on other databases.
+            # - The tag and year filters of the facets are part of the backend query, so they
+            # - find every matching post, not only the best ranked ones. The ranked hits are
+            # - cached by normalized query and filters (see blog/search/).
+            tag = form.cleaned_data['tag'] or None
+            year = form.cleaned_data['year']
+            hits = search_hits(query, tag, year)
 
             # Another search approach is trigram similarity. A trigram is a group of three consecutive characters.
             # - You can measure the similarity of two strings by counting the number of trigrams that they share.
             # - This approach turns out to be very effective for measuring the similarity of words in many languages.
-            # - Searching for 'yango' will give you 'django' results
-            # replace results fields with: #
-            # results = Post.published.annotate(
-            #     similarity=TrigramSimilarity('title', query),
-            # ).filter(similarity__gt=0.1).order_by('-similarity')
+            # - Searching for 'yango' will give you 'django' results.
+            # When full-text search finds nothing at all (not just nothing with the filters), fall
+            # - back to posts whose title or tags look like the query (through the pg_trgm indexes
+            # - on PostgreSQL, or the corrected query with BM25) and suggest a corrected query.
+            if not hits and not ((tag or year) and search_hits(query)):
+                fuzzy = True
+                suggestion = suggest_query(query)
+                hits = fuzzy_search_hits(query, tag, year)
+
+            # At most BLOG_SEARCH_MAX_RESULTS hits (plus one) are kept, so instead of an exact
+            # - COUNT(*) over every match the page shows "about N results".
+            max_results = max_search_results()
+            more_results = len(hits) > max_results
+            total_results = min(len(hits), max_results)
+            # Count the tags and years of every match, with a grouped query per facet
+            # - instead of a count query per facet value (see blog/search/facets.py).
+            facets = search_facets(query, tag, year, fuzzy)
+            # Results are paged with a cursor on (rank, id). Only the posts of the page are
+            # - loaded, with their authors joined in and without their full bodies.
+            paginator = SearchPaginator(
+                hits,
+                getattr(settings, 'BLOG_SEARCH_RESULTS_PER_PAGE', 10),
+                Post.published.select_related('author').defer('body', 'body_html', 'search_vector'),
+                max_results,
+            )
+            try:
+                results = paginator.page(request.GET.get('cursor'))
+            except InvalidCursor:
+                results = paginator.page()
+            # Highlight where the query matched, for the posts of this page only. Fuzzy
+            # - results are highlighted with the corrected query when there is one.
+            add_snippets(results, suggestion or query)
+            # The query and the filters are carried along by the pagination links.
+            page_query = {key: value for key, value in (('query', query), ('tag', tag), ('year', year)) if value}
 
     return render(request,
                   'blog/post/search.html',
@@ -184,5 +281,82 @@ def post_search(request):
                       'form': form,
                       'query': query,
                       'results': results,
+                      'total_results': total_results,
+                      'more_results': more_results,
+                      'fuzzy': fuzzy,
+                      'suggestion': suggestion,
+                      'facets': facets,
+                      'tag': tag,
+                      'year': year,
+                      'page_query': urlencode(page_query),
                   }
                   )
+
+
+# Search box autocomplete: JSON suggestions (post titles and tags) for what the
+# - reader typed so far, ?q=<prefix>. It's called on every keystroke, so it's
+# - answered from the in-memory prefix index in blog/autocomplete.py and may be
+# - cached briefly by the browser.
+def post_autocomplete(request):
+    prefix = request.GET.get('q', '')[:100]
+    response = JsonResponse({'query': prefix, 'suggestions': suggest(prefix)})
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+# Whether the Accept-Encoding header of the request allows gzip: gzip (or x-gzip)
+# - is listed, or failing that '*' is, with a q-value above 0 ('gzip;q=0' refuses it).
+def accepts_gzip(request):
+    qualities = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+# Serve a pre-generated, gzipped sitemap file. Crawlers that accept gzip get the
+# - file as it is on disk; others get it decompressed.
+def serve_sitemap(request, filename):
+    path = sitemap_path(filename)
+    try:
+        last_modified = int(os.stat(path).st_mtime)
+    except FileNotFoundError:
+        raise Http404('No such sitemap.')
+    response = get_conditional_response(request, last_modified=last_modified)
+    if response is None:
+        with open(path, 'rb') as sitemap:
+            content = sitemap.read()
+        if accepts_gzip(request):
+            response = HttpResponse(content, content_type='application/xml')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(content), content_type='application/xml')
+    response['Last-Modified'] = http_date(last_modified)
+    # Both encodings are served from one URL, so caches must key on Accept-Encoding.
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+# The sitemap index, listing one sitemap per section of posts. The files are written
+# - by `manage.py build_sitemaps`; the first request builds them if they are missing.
+def sitemap_index(request):
+    if not os.path.exists(sitemap_path(INDEX_FILE)):
+        build_sitemaps()
+    return serve_sitemap(request, INDEX_FILE)
+
+
+def sitemap_section(request, section):
+    return serve_sitemap(request, section_file(section))
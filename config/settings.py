@@ -88,6 +88,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# The sidebar fragment, counters and generation counters live here. Use a shared cache
+# - (memcached, redis) when running several processes so they all see the same generations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Password validation
 # https±://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -124,6 +135,104 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Blog
+# Number of posts shown on each page of the post list.
+BLOG_POSTS_PER_PAGE = 3
+# 'keyset' paginates the post list with ?cursor= tokens keyed on (publish, id), so deep
+# - pages cost the same as the first one. 'offset' uses numbered ?page= links instead.
+BLOG_PAGINATION = 'keyset'
+# Seconds a post counter (posts per status / per tag) is kept in the cache.
+BLOG_COUNTER_CACHE_TIMEOUT = 60
+# Use PostgreSQL planner estimates instead of exact counts for results of at least
+# - BLOG_ESTIMATED_COUNT_THRESHOLD rows. Useful for very large tables.
+BLOG_ESTIMATED_COUNTS = False
+BLOG_ESTIMATED_COUNT_THRESHOLD = 100000
+# Markdown extensions used to render post bodies. Changing them (or upgrading Markdown)
+# - marks the stored HTML as stale; run `manage.py render_posts` to render it again.
+BLOG_MARKDOWN_EXTENSIONS = []
+# Number of words of the pre-rendered excerpt shown on the post list.
+BLOG_EXCERPT_WORDS = 30
+# Memoization of the markdown template filter: a per process LRU bounded by entries and
+# - bytes, optionally backed by a shared Django cache (give its alias in SHARED_CACHE).
+BLOG_MARKDOWN_CACHE = {
+    'MAX_ENTRIES': 1000,
+    'MAX_BYTES': 16 * 1024 * 1024,
+    'SHARED_CACHE': None,
+    'TIMEOUT': 3600,
+}
+# Number of precomputed similar posts stored per post (the detail page shows 4). Migration
+# - 0016 fills them in for the existing posts; run `manage.py rebuild_similar_posts` after
+# - changing this.
+BLOG_SIMILAR_POSTS_KEPT = 10
+# Keep an in-memory inverted index from tag to published posts in every process. It answers
+# - tag pages and similar posts without SQL and is built in the background on the first request.
+BLOG_TAG_INDEX = True
+# Search box autocomplete (blog:post_autocomplete): suggestions per lookup, shortest prefix
+# - answered, and seconds between reloads of the popularity weights of the prefix index.
+BLOG_AUTOCOMPLETE = {
+    'LIMIT': 8,
+    'MIN_LENGTH': 2,
+    'REFRESH': 3600,
+}
+# Dotted path of the search backend class. None picks 'blog.search.postgres.PostgresBackend'
+# - on PostgreSQL and the built-in in-memory BM25 engine, 'blog.search.bm25.BM25Backend',
+# - on other databases.
+BLOG_SEARCH_BACKEND = None
+# Number of search results per page, and how far a search can be paged. Matches are
+# - only counted up to BLOG_SEARCH_MAX_RESULTS ("about N results").
+BLOG_SEARCH_RESULTS_PER_PAGE = 10
+BLOG_SEARCH_MAX_RESULTS = 200
+# Number of tags listed in the tag facet of the search results.
+BLOG_SEARCH_FACET_TAGS = 10
+# Highlighted search result snippets: characters of a body read per result (whatever the
+# - length of the post) and words shown around the matches.
+BLOG_SEARCH_SNIPPETS = {
+    'MAX_CHARS': 5000,
+    'MAX_WORDS': 30,
+}
+# Per process LRU of search results (ranked post ids) keyed by the case folded query. The
+# - hit rate is logged by blog.search every STATS_EVERY lookups.
+BLOG_SEARCH_CACHE = {
+    'MAX_ENTRIES': 1000,
+    'STATS_EVERY': 1000,
+}
+
+# Seconds a serialized feed stays in the cache. Feeds are rebuilt when a post changes anyway.
+BLOG_FEED_CACHE_TIMEOUT = 86400
+# Sitemap index (sitemap.xml) and its sections, pre-generated as gzipped files in ROOT by
+# - `manage.py build_sitemaps` (run it from cron). Published posts are split into sections of
+# - SECTION_SIZE consecutive ids, and only the sections whose posts changed are written again.
+# - PROTOCOL and the domain of the current Site make the absolute URLs.
+BLOG_SITEMAP = {
+    'ROOT': os.path.join(BASE_DIR, 'sitemaps'),
+    'SECTION_SIZE': 10000,
+    'PROTOCOL': 'https',
+}
+# Outbox of the emails sent by the site, drained by `manage.py send_outbox`: emails claimed
+# - per batch, workers (each with one reused email connection, so also the most connections
+# - open at a time), attempts before giving up, and the retry backoff in seconds (doubled
+# - per failure up to MAX_BACKOFF). A worker renews the lease of its batch every LEASE / 2
+# - seconds; one that dies releases the batch after LEASE seconds.
+BLOG_OUTBOX = {
+    'BATCH_SIZE': 50,
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 60,
+    'MAX_BACKOFF': 3600,
+    'LEASE': 300,
+}
+# Digest of new posts emailed to the subscribers by `manage.py send_digest`: days covered by
+# - the first digest (later ones cover the posts since the previous digest), subscribers sent
+# - to over one connection, sending threads, sender address, and the protocol of the links.
+BLOG_DIGEST = {
+    'DAYS': 7,
+    'CHUNK_SIZE': 100,
+    'WORKERS': 4,
+    'FROM_EMAIL': 'admin@myblog.com',
+    'PROTOCOL': 'https',
+}
+# Number of rows changed per UPDATE or DELETE by the bulk moderation actions.
+BLOG_MODERATION_BATCH_SIZE = 1000
 # If you can't use an SMTP server, you can tell Django to write emails to the console.
 # - This is very useful for testing your application without an SMTP server.
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -15,16 +15,12 @@ Including another URLconf
 """
 from django.urls import path, include
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
-from blog.sitemaps import PostSitemap
-
-sitemaps = {
-    'posts': PostSitemap,
-}
+from blog import views as blog_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps},
-         name='django.contrib.sitemaps.views.sitemap'),
+    # Sitemap index and its sections, served from the files written by `manage.py build_sitemaps`.
+    path('sitemap.xml', blog_views.sitemap_index, name='sitemap'),
+    path('sitemap-posts-<int:section>.xml', blog_views.sitemap_section, name='sitemap_section'),
 ]